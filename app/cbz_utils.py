@@ -1,3 +1,8 @@
+import copy
+import mmap
+import os
+import re
+import struct
 import zipfile
 import tempfile
 import shutil
@@ -7,6 +12,115 @@ import logging
 
 logger = logging.getLogger('manga-manager.cbz')
 
+# Buffer size for streaming entry data to disk or between archives
+COPY_BUFFER_SIZE = 1 << 20
+
+_NUM_RE = re.compile(r'(\d+)')
+
+# Entries that are deflated are small text files (ComicInfo.xml); level 1
+# is several times faster than zlib's default with near-identical output size
+_DEFLATE_LEVEL = 1
+
+# Lower-case image extensions, as a tuple so str.endswith can test them all
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# Entry names used for a dedicated cover page
+_COVER_NAMES = frozenset({'000_cover.jpg', '000_cover.png', '000.jpg', '000.png'})
+
+# Archives below this size are read through a memory map
+MMAP_MAX_SIZE = 512 * 1024 * 1024
+
+# ZIP record layout used by the central-directory probe
+_EOCD_SIG = b'PK\x05\x06'
+_EOCD_SIZE = 22
+_EOCD_MAX_SIZE = _EOCD_SIZE + 0xFFFF  # record plus the longest archive comment
+_ZIP64_LOCATOR_SIG = b'PK\x06\x07'
+_ZIP64_LOCATOR_SIZE = 20
+_CD_SIG = b'PK\x01\x02'
+_CD_HEADER_SIZE = 46
+_CD_NAME_LEN_OFFSET = 28
+
+
+def _central_directory_has(cd: bytes, name: bytes) -> bool:
+    """Check raw central-directory bytes for an entry named exactly name."""
+    pos = cd.find(name)
+    while pos != -1:
+        # A real match starts right after a header whose name length fits
+        header = pos - _CD_HEADER_SIZE
+        if (header >= 0 and cd[header:header + 4] == _CD_SIG and
+                struct.unpack_from('<H', cd, header + _CD_NAME_LEN_OFFSET)[0] == len(name)):
+            return True
+        pos = cd.find(name, pos + 1)
+    return False
+
+
+def _compress_type_for(filename: str) -> int:
+    """Pick the ZIP compression method for a new entry."""
+    # Image formats are already compressed; deflating them again wastes CPU
+    if filename.lower().endswith(_IMAGE_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def page_manifest(file_path) -> frozenset:
+    """Identify an archive by its pages, ignoring what processing changes.
+    
+    Read from the central directory alone: name, CRC-32 and size of every
+    entry except ComicInfo.xml and cover entries, which processing writes
+    or removes. A processed copy keeps the manifest of the original.
+    
+    Args:
+        file_path: Archive to read
+    
+    Returns:
+        Frozenset of (name, crc, size) tuples
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        return frozenset(
+            (info.filename, info.CRC, info.file_size)
+            for info in zf.infolist()
+            if info.filename != 'ComicInfo.xml' and info.filename not in _COVER_NAMES
+        )
+
+class _MappedFile:
+    """Read-only file object over a memory map, as zipfile expects it.
+    
+    mmap has no seekable() or readinto(), both of which the archive code
+    relies on.
+    """
+    
+    def __init__(self, path: Path):
+        self.name = str(path)
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._map.seek(offset, whence)
+        return self._map.tell()
+    
+    def tell(self) -> int:
+        return self._map.tell()
+    
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self._map) - self._map.tell()
+        return self._map.read(size)
+    
+    def readinto(self, buffer) -> int:
+        start = self._map.tell()
+        n = min(len(buffer), len(self._map) - start)
+        with memoryview(self._map) as view:
+            buffer[:n] = view[start:start + n]
+        self._map.seek(start + n)
+        return n
+    
+    def close(self):
+        self._map.close()
+
+
 class CBZFile:
     """Utilities for reading and writing CBZ (Comic Book ZIP) files."""
     
@@ -16,24 +130,76 @@ class CBZFile:
             file_path: Path to CBZ file
         """
         self.file_path = Path(file_path)
+        self._zf = None
+        self._mapped = None
+        self._namelist = None
+        self._name_set = None
+        self._images = None
         self._validate_cbz()
     
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
     def _validate_cbz(self):
         """Validate that file is a valid ZIP archive."""
         if not self.file_path.exists():
             raise FileNotFoundError(f"CBZ file not found: {self.file_path}")
         
-        if not zipfile.is_zipfile(self.file_path):
+        # Opening the archive parses the central directory once; the handle
+        # is kept for every later query on this instance.
+        try:
+            self._zip()
+        except zipfile.BadZipFile:
             raise ValueError(f"File is not a valid ZIP/CBZ archive: {self.file_path}")
     
+    def _zip(self) -> zipfile.ZipFile:
+        """Get the cached read handle, opening the archive on first use."""
+        if self._zf is None:
+            size = self.file_path.stat().st_size
+            if 0 < size < MMAP_MAX_SIZE:
+                # Directory parsing and entry reads become page faults
+                # instead of seek/read syscalls
+                self._mapped = _MappedFile(self.file_path)
+                try:
+                    self._zf = zipfile.ZipFile(self._mapped, 'r')
+                except Exception:
+                    self._mapped.close()
+                    self._mapped = None
+                    raise
+            else:
+                self._zf = zipfile.ZipFile(self.file_path, 'r')
+        return self._zf
+    
+    def close(self):
+        """Close the cached archive handle and drop cached listings."""
+        if self._zf is not None:
+            self._zf.close()
+            self._zf = None
+        if self._mapped is not None:
+            # Mutations reopen the file normally, so the map must go first
+            self._mapped.close()
+            self._mapped = None
+        self._namelist = None
+        self._name_set = None
+        self._images = None
+    
+    def _names(self) -> List[str]:
+        """Get the cached list of entry names."""
+        if self._namelist is None:
+            self._namelist = [info.filename for info in self._zip().infolist()]
+            self._name_set = set(self._namelist)
+        return self._namelist
+    
     def list_files(self) -> List[str]:
         """List all files in the CBZ archive.
         
         Returns:
             List of file paths inside the archive
         """
-        with zipfile.ZipFile(self.file_path, 'r') as zf:
-            return zf.namelist()
+        return list(self._names())
     
     def get_image_files(self) -> List[str]:
         """Get list of image files in the archive.
@@ -41,24 +207,24 @@ class CBZFile:
         Returns:
             List of image file paths, sorted naturally
         """
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-        files = self.list_files()
-        
-        # Filter image files
-        images = [
-            f for f in files 
-            if Path(f).suffix.lower() in image_extensions
-            and not f.startswith('__MACOSX')  # Skip Mac OS metadata
-            and not Path(f).name.startswith('.')  # Skip hidden files
-        ]
+        if self._images is None:
+            # Filter image files
+            images = [
+                f for f in self._names()
+                if f.lower().endswith(_IMAGE_EXTENSIONS)
+                and not f.startswith('__MACOSX')  # Skip Mac OS metadata
+                and not f.rsplit('/', 1)[-1].startswith('.')  # Skip hidden files
+            ]
+            
+            # Sort naturally (001.jpg, 002.jpg, etc.)
+            self._images = sorted(images, key=CBZFile._natural_sort_key)
         
-        # Sort naturally (001.jpg, 002.jpg, etc.)
-        return sorted(images, key=self._natural_sort_key)
+        return list(self._images)
     
-    def _natural_sort_key(self, text):
+    @staticmethod
+    def _natural_sort_key(text):
         """Natural sort key for filenames with numbers."""
-        import re
-        return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', str(text))]
+        return [int(c) if c.isdigit() else c.lower() for c in _NUM_RE.split(str(text))]
     
     def has_file(self, filename: str) -> bool:
         """Check if specific file exists in archive.
@@ -69,7 +235,49 @@ class CBZFile:
         Returns:
             True if file exists
         """
-        return filename in self.list_files()
+        self._names()
+        return filename in self._name_set
+    
+    @staticmethod
+    def has_file_fast(file_path, filename: str) -> bool:
+        """Check if an archive contains a file without opening it as a ZipFile.
+        
+        Only the end-of-central-directory record and the raw central
+        directory are read; no entry metadata is parsed. Archives the probe
+        cannot handle (ZIP64, damaged records) fall back to a full parse.
+        
+        Args:
+            file_path: Path to CBZ file
+            filename: File to check for (e.g., '000_cover.jpg')
+        
+        Returns:
+            True if file exists
+        """
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            tail_start = max(0, size - _EOCD_MAX_SIZE)
+            f.seek(tail_start)
+            tail = f.read()
+            
+            eocd = tail.rfind(_EOCD_SIG)
+            is_zip64 = (eocd >= _ZIP64_LOCATOR_SIZE and
+                        tail[eocd - _ZIP64_LOCATOR_SIZE:eocd - _ZIP64_LOCATOR_SIZE + 4] == _ZIP64_LOCATOR_SIG)
+            if eocd != -1 and len(tail) - eocd >= _EOCD_SIZE and not is_zip64:
+                cd_size = struct.unpack_from('<L', tail, eocd + 12)[0]
+                # Measured back from the EOCD so data prepended to the
+                # archive does not throw off the stored offset
+                cd_end = tail_start + eocd
+                cd_start = cd_end - cd_size
+                if cd_start >= 0:
+                    if cd_start >= tail_start:
+                        cd = tail[cd_start - tail_start:eocd]
+                    else:
+                        f.seek(cd_start)
+                        cd = f.read(cd_size)
+                    return _central_directory_has(cd, filename.encode('utf-8'))
+        
+        with CBZFile(file_path) as cbz:
+            return cbz.has_file(filename)
     
     def read_file(self, filename: str) -> bytes:
         """Read file content from archive.
@@ -80,8 +288,7 @@ class CBZFile:
         Returns:
             File content as bytes
         """
-        with zipfile.ZipFile(self.file_path, 'r') as zf:
-            return zf.read(filename)
+        return self._zip().read(filename)
     
     def extract_file(self, filename: str, dest_path: Path) -> Path:
         """Extract specific file from archive.
@@ -94,18 +301,55 @@ class CBZFile:
             Path to extracted file
         """
         dest_path = Path(dest_path)
+        zf = self._zip()
         
-        with zipfile.ZipFile(self.file_path, 'r') as zf:
-            if dest_path.is_dir():
-                # Extract to directory with original filename
-                extracted = zf.extract(filename, dest_path)
-                return Path(extracted)
+        if dest_path.is_dir():
+            # Extract to directory with original filename
+            extracted = zf.extract(filename, dest_path)
+            return Path(extracted)
+        else:
+            # Stream to specific file path without materializing the entry
+            info = zf.getinfo(filename)
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            if (info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1
+                    and hasattr(os, 'sendfile')):
+                self._send_stored(info, dest_path)
             else:
-                # Extract to specific file path
-                content = zf.read(filename)
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                dest_path.write_bytes(content)
-                return dest_path
+                with zf.open(info) as src, open(dest_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, min(info.file_size, COPY_BUFFER_SIZE))
+            return dest_path
+    
+    def _send_stored(self, zinfo: zipfile.ZipInfo, dest_path: Path):
+        """Copy a stored entry from the archive to a file with sendfile().
+        
+        A stored entry is the file's bytes as-is, so the kernel copies them
+        without passing them through zipfile or a Python buffer. The CRC is
+        not checked on this path.
+        
+        Args:
+            zinfo: Uncompressed, unencrypted entry
+            dest_path: Destination file path
+        """
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            # Locate the entry data behind its local header
+            header = struct.unpack(zipfile.structFileHeader,
+                                   os.pread(fd, zipfile.sizeFileHeader, zinfo.header_offset))
+            if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile(f"Bad local header for {zinfo.filename} in {self.file_path.name}")
+            offset = (zinfo.header_offset + zipfile.sizeFileHeader
+                      + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+            
+            with open(dest_path, 'wb') as dst:
+                remaining = zinfo.file_size
+                while remaining > 0:
+                    sent = os.sendfile(dst.fileno(), fd, offset, remaining)
+                    if not sent:
+                        raise zipfile.BadZipFile(f"Truncated entry {zinfo.filename} in {self.file_path.name}")
+                    offset += sent
+                    remaining -= sent
+        finally:
+            os.close(fd)
     
     def get_cover_image(self) -> Optional[str]:
         """Get cover image filename from archive.
@@ -124,7 +368,7 @@ class CBZFile:
         
         # Check for dedicated cover file
         for img in images:
-            if Path(img).name.lower() in ['000_cover.jpg', '000_cover.png', '000.jpg', '000.png']:
+            if img.rsplit('/', 1)[-1].lower() in _COVER_NAMES:
                 return img
         
         # Return first image
@@ -147,6 +391,138 @@ class CBZFile:
         
         return self.extract_file(cover, dest_path)
     
+    def _copy_raw_entries(self, zf_out: zipfile.ZipFile, exclude: str):
+        """Copy entries into another archive without recompressing them.
+        
+        The compressed bytes of each entry are copied as-is behind a fresh
+        local header, so untouched pages are never inflated and deflated
+        again.
+        
+        Args:
+            zf_out: Archive opened for writing
+            exclude: Entry name to leave out
+        """
+        zf_in = self._zip()
+        src = zf_in.fp
+        dst = zf_out.fp
+        buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+        
+        for zinfo in zf_in.infolist():
+            if zinfo.filename == exclude:
+                continue
+            
+            # Locate the entry data behind its local header
+            src.seek(zinfo.header_offset)
+            header = struct.unpack(zipfile.structFileHeader, src.read(zipfile.sizeFileHeader))
+            src.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+            
+            # Sizes and CRC are known up front, so no data descriptor is needed
+            out_info = copy.copy(zinfo)
+            out_info.flag_bits &= ~0x08
+            out_info.header_offset = dst.tell()
+            zip64 = (zinfo.file_size > zipfile.ZIP64_LIMIT
+                     or zinfo.compress_size > zipfile.ZIP64_LIMIT)
+            dst.write(out_info.FileHeader(zip64))
+            
+            remaining = zinfo.compress_size
+            while remaining > 0:
+                n = src.readinto(buffer[:min(remaining, COPY_BUFFER_SIZE)])
+                if not n:
+                    raise zipfile.BadZipFile(f"Truncated entry {zinfo.filename} in {self.file_path.name}")
+                dst.write(buffer[:n])
+                remaining -= n
+            
+            zf_out.filelist.append(out_info)
+            zf_out.NameToInfo[out_info.filename] = out_info
+        
+        zf_out.start_dir = dst.tell()
+        zf_out._didModify = True
+    
+    def _drop_entry(self, zf: zipfile.ZipFile, filename: str):
+        """Drop an entry from an archive opened in append mode.
+        
+        Only the central directory written on close forgets the entry; its
+        bytes stay in the file.
+        
+        Args:
+            zf: Archive opened with mode 'a'
+            filename: Entry to drop
+        """
+        if filename not in zf.NameToInfo:
+            return
+        
+        zf.filelist = [info for info in zf.filelist if info.filename != filename]
+        zf.NameToInfo.pop(filename, None)
+        zf._didModify = True
+    
+    def _update_in_place(self, filename: str, content: Optional[bytes] = None):
+        """Remove and optionally re-add an entry without rewriting the archive.
+        
+        New data and a fresh central directory are appended after the end of
+        the file, so no existing byte (old directory included) is overwritten
+        and the file never shrinks below its old size, which other readers
+        may have memory-mapped. If the append fails, the appended bytes are
+        cut off again and the archive is rewritten through a temporary file
+        instead.
+        
+        Args:
+            filename: Entry to replace or remove
+            content: New entry content, or None to only remove the entry
+        """
+        # Cached handle and listings describe the old archive
+        self.close()
+        
+        original_size = self.file_path.stat().st_size
+        try:
+            with zipfile.ZipFile(self.file_path, 'a', zipfile.ZIP_DEFLATED) as zf:
+                zf.start_dir = original_size
+                zf.fp.seek(original_size)
+                self._drop_entry(zf, filename)
+                if content is not None:
+                    zf.writestr(filename, content,
+                                compress_type=_compress_type_for(filename),
+                                compresslevel=_DEFLATE_LEVEL)
+        except Exception as e:
+            logger.warning(f"In-place update of {self.file_path.name} failed ({e}), rewriting")
+            # The old directory and end record were left untouched
+            os.truncate(self.file_path, original_size)
+            self._rewrite_to(self.file_path, filename, content)
+            self.close()
+    
+    def _rewrite_to(self, output_path: Path, filename: str, content: Optional[bytes] = None):
+        """Write a copy of the archive to output_path with filename replaced.
+        
+        The copy is built in a temporary file next to output_path so the
+        final os.replace() is a rename on the same filesystem, not a copy.
+        
+        Args:
+            output_path: Path for the modified CBZ
+            filename: Entry to leave out of the copy
+            content: New content for filename, or None to drop it
+        """
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(suffix='.cbz.tmp', dir=output_path.parent)
+        try:
+            with os.fdopen(fd, 'w+b') as temp_file:
+                # Copy all files except the one we're replacing
+                with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED) as zf_out:
+                    self._copy_raw_entries(zf_out, exclude=filename)
+                    
+                    if content is not None:
+                        zf_out.writestr(filename, content,
+                                        compress_type=_compress_type_for(filename),
+                                        compresslevel=_DEFLATE_LEVEL)
+            
+            # mkstemp creates the file 0600; keep the source archive's mode
+            shutil.copymode(self.file_path, temp_name)
+            os.replace(temp_name, output_path)
+        except BaseException:
+            try:
+                os.unlink(temp_name)
+            except OSError:
+                pass
+            raise
+    
     def add_or_update_file(self, filename: str, content: bytes, output_path: Optional[Path] = None):
         """Add or update a file in the CBZ archive.
         
@@ -155,26 +531,14 @@ class CBZFile:
             content: File content as bytes
             output_path: Path for modified CBZ (if None, overwrites original)
         """
-        output_path = output_path or self.file_path
+        output_path = Path(output_path) if output_path else self.file_path
         
-        # Create temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_dir = Path(temp_dir)
-            temp_cbz = temp_dir / 'temp.cbz'
-            
-            # Copy all files except the one we're updating
-            with zipfile.ZipFile(self.file_path, 'r') as zf_in:
-                with zipfile.ZipFile(temp_cbz, 'w', zipfile.ZIP_DEFLATED) as zf_out:
-                    for item in zf_in.namelist():
-                        if item != filename:
-                            data = zf_in.read(item)
-                            zf_out.writestr(item, data)
-                    
-                    # Add new/updated file
-                    zf_out.writestr(filename, content)
-            
-            # Replace original or write to new location
-            shutil.move(str(temp_cbz), str(output_path))
+        if output_path == self.file_path:
+            self._update_in_place(filename, content)
+            logger.info(f"Updated {filename} in {output_path.name}")
+            return
+        
+        self._rewrite_to(output_path, filename, content)
         
         logger.info(f"Updated {filename} in {output_path.name}")
     
@@ -189,20 +553,13 @@ class CBZFile:
             logger.debug(f"{filename} not found in {self.file_path.name}")
             return
         
-        output_path = output_path or self.file_path
+        output_path = Path(output_path) if output_path else self.file_path
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_dir = Path(temp_dir)
-            temp_cbz = temp_dir / 'temp.cbz'
-            
-            # Copy all files except the one we're removing
-            with zipfile.ZipFile(self.file_path, 'r') as zf_in:
-                with zipfile.ZipFile(temp_cbz, 'w', zipfile.ZIP_DEFLATED) as zf_out:
-                    for item in zf_in.namelist():
-                        if item != filename:
-                            data = zf_in.read(item)
-                            zf_out.writestr(item, data)
-            
-            shutil.move(str(temp_cbz), str(output_path))
+        if output_path == self.file_path:
+            self._update_in_place(filename)
+            logger.info(f"Removed {filename} from {output_path.name}")
+            return
+        
+        self._rewrite_to(output_path, filename)
         
         logger.info(f"Removed {filename} from {output_path.name}")
@@ -1,21 +1,59 @@
+import copy
+import functools
 import yaml
 import os
+from dataclasses import dataclass
 from pathlib import Path
 
+try:
+    # LibYAML's C parser, when PyYAML was built with it
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_yaml(config_path, mtime_ns):
+    """Parse a YAML file once per (path, modification time)."""
+    with open(config_path, 'r') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Resolved top-level settings with defaults applied."""
+    log_level: str
+    check_interval: int
+    paths: dict
+    processing: dict
+    naming: dict
+    metadata: dict
+
+
 class Config:
     """Configuration loader for manga-manager settings."""
     
     def __init__(self, config_path='/config/settings.yml'):
         self.config_path = config_path
         self.config = self._load_config()
+        self.settings = Settings(
+            log_level=self.get('general', 'log_level', default='INFO'),
+            check_interval=self.get('general', 'check_interval', default=30),
+            paths=self.get('paths', default={}),
+            processing=self.get('processing', default={}),
+            naming=self.get('naming', default={}),
+            metadata=self.get('metadata', default={}),
+        )
     
     def _load_config(self):
         """Load configuration from YAML file."""
         if not os.path.exists(self.config_path):
             raise FileNotFoundError(f"Configuration file not found: {self.config_path}")
         
-        with open(self.config_path, 'r') as f:
-            return yaml.safe_load(f)
+        # The parse is shared between instances; each gets its own copy so
+        # changing one Config's sections leaves the others alone
+        parsed = _parse_yaml(self.config_path, os.stat(self.config_path).st_mtime_ns)
+        return copy.deepcopy(parsed)
     
     def get(self, *keys, default=None):
         """Get nested configuration value.
@@ -36,24 +74,24 @@ class Config:
     
     @property
     def log_level(self):
-        return self.get('general', 'log_level', default='INFO')
+        return self.settings.log_level
     
     @property
     def check_interval(self):
-        return self.get('general', 'check_interval', default=30)
+        return self.settings.check_interval
     
     @property
     def paths(self):
-        return self.get('paths', default={})
+        return self.settings.paths
     
     @property
     def processing(self):
-        return self.get('processing', default={})
+        return self.settings.processing
     
     @property
     def naming(self):
-        return self.get('naming', default={})
+        return self.settings.naming
     
     @property
     def metadata(self):
-        return self.get('metadata', default={})
+        return self.settings.metadata
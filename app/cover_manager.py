@@ -1,6 +1,8 @@
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple, Union
 import logging
+import threading
 from PIL import Image
 import io
 
@@ -9,9 +11,46 @@ from database import Database
 
 logger = logging.getLogger('manga-manager.cover')
 
+# JPEG files start with an SOI marker followed by another marker
+JPEG_MAGIC = b'\xff\xd8\xff'
+
+# Leading bytes of the image formats accepted as uploaded covers
+IMAGE_SIGNATURES = (
+    (JPEG_MAGIC, 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Identify an image format from the first 12 bytes of a file.
+    
+    Args:
+        head: Start of the file
+    
+    Returns:
+        'JPEG', 'PNG', 'GIF' or 'WEBP', or None for anything else
+    """
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    # RIFF container: size in bytes 4-8, then the form type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
 class CoverManager:
     """Manages cover images for manga volumes."""
     
+    # Converted covers are scaled down to this width and re-encoded at this
+    # quality; covers that are already JPEG are stored untouched
+    target_width = 1200
+    jpeg_quality = 85
+    
+    # Number of volume covers whose bytes are kept in memory for reuse
+    cover_bytes_cache_size = 32
+    
     def __init__(self, covers_cache_path: Path, database: Database):
         """
         Args:
@@ -21,6 +60,13 @@ class CoverManager:
         self.covers_path = Path(covers_cache_path)
         self.db = database
         
+        # Volume directories already created by this instance
+        self._dir_cache = set()
+        
+        # (series, volume) -> cover bytes, least recently used first
+        self._cover_bytes = OrderedDict()
+        self._cover_bytes_lock = threading.Lock()
+        
         # Ensure covers directory exists
         self.covers_path.mkdir(parents=True, exist_ok=True)
     
@@ -35,7 +81,9 @@ class CoverManager:
             Path to cover file
         """
         series_dir = self.covers_path / series / f"Vol.{volume:03d}"
-        series_dir.mkdir(parents=True, exist_ok=True)
+        if series_dir not in self._dir_cache:
+            series_dir.mkdir(parents=True, exist_ok=True)
+            self._dir_cache.add(series_dir)
         return series_dir / "cover.jpg"
     
     def has_cover(self, series: str, volume: int) -> bool:
@@ -51,6 +99,25 @@ class CoverManager:
         cover_path = self.get_cover_path(series, volume)
         return cover_path.exists()
     
+    def has_covers_bulk(self, pairs: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], bool]:
+        """Check cover existence for many volumes at once.
+        
+        Each distinct volume costs one stat of its cover file. Unlike
+        has_cover, no directories are created.
+        
+        Args:
+            pairs: (series, volume) pairs
+        
+        Returns:
+            Dictionary mapping each pair to True if its cover file exists
+        """
+        result = {}
+        for series, volume in pairs:
+            if (series, volume) not in result:
+                cover_path = self.covers_path / series / f"Vol.{volume:03d}" / "cover.jpg"
+                result[(series, volume)] = cover_path.is_file()
+        return result
+    
     def extract_cover_from_cbz(self, cbz_path: Path, series: str, 
                                volume: int, force: bool = False) -> Tuple[bool, Optional[Path], str]:
         """Extract cover from CBZ file and save to cache.
@@ -72,14 +139,14 @@ class CoverManager:
             return True, cover_path, "Cover already exists"
         
         try:
-            cbz = CBZFile(cbz_path)
-            
             # Extract cover using CBZ utilities
-            extracted = cbz.extract_cover(cover_path)
+            with CBZFile(cbz_path) as cbz:
+                extracted = cbz.extract_cover(cover_path)
             
             if extracted:
                 # Verify it's a valid image and convert to JPEG if needed
                 self._ensure_jpeg(cover_path)
+                self._forget_cover_bytes(series, volume)
                 logger.info(f"Extracted cover for {series} Vol.{volume} from {cbz_path.name}")
                 return True, cover_path, "Cover extracted successfully"
             else:
@@ -99,28 +166,60 @@ class CoverManager:
             image_path: Path to image file
         """
         try:
+            # Already a JPEG with the right extension: nothing to convert, so
+            # skip decoding it entirely
+            if image_path.suffix.lower() == '.jpg':
+                with open(image_path, 'rb') as f:
+                    if f.read(3) == JPEG_MAGIC:
+                        return
+            
             with Image.open(image_path) as img:
-                # Convert to RGB if needed (remove alpha channel)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = rgb_img
+                source_format = img.format
+                img = self._prepare_cover_image(img)
                 
                 # Save as JPEG if not already
                 if image_path.suffix.lower() != '.jpg':
                     new_path = image_path.with_suffix('.jpg')
-                    img.save(new_path, 'JPEG', quality=95)
+                    self._save_jpeg(img, new_path)
                     image_path.unlink()  # Remove original
                     logger.debug(f"Converted {image_path.name} to JPEG")
-                elif img.format != 'JPEG':
-                    img.save(image_path, 'JPEG', quality=95)
+                elif source_format != 'JPEG':
+                    self._save_jpeg(img, image_path)
                     logger.debug(f"Re-saved {image_path.name} as JPEG")
                     
         except Exception as e:
             logger.warning(f"Could not ensure JPEG format for {image_path}: {e}")
     
+    def _prepare_cover_image(self, img: Image.Image) -> Image.Image:
+        """Flatten transparency and scale an opened image down to cover size.
+        
+        Args:
+            img: Opened (not yet loaded) image
+        
+        Returns:
+            RGB-compatible image no wider than target_width
+        """
+        box = (self.target_width, self.target_width * 2)
+        
+        # Let libjpeg decode at a reduced scale when the source is larger
+        # than needed (no-op for other formats)
+        img.draft('RGB', box)
+        
+        # Convert to RGB if needed (remove alpha channel)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+            img = rgb_img
+        
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+        return img
+    
+    def _save_jpeg(self, img: Image.Image, path: Path):
+        """Save image as a progressive, optimized JPEG."""
+        img.save(path, 'JPEG', quality=self.jpeg_quality, optimize=True, progressive=True)
+    
     def get_existing_cover(self, series: str, volume: int) -> Optional[Path]:
         """Get existing cover from cache or database.
         
@@ -143,24 +242,62 @@ class CoverManager:
         
         return None
     
-    def copy_cover_to_cbz(self, cbz_path: Path, cover_source: Path) -> bool:
+    def _get_cover_bytes(self, series: str, volume: int, cover_path: Path) -> Optional[bytes]:
+        """Get a volume's cover bytes, reading the file only on first use.
+        
+        Args:
+            series: Series name
+            volume: Volume number
+            cover_path: Cover file to read on a cache miss
+        
+        Returns:
+            Cover image bytes, or None if the file could not be read
+        """
+        key = (series, volume)
+        with self._cover_bytes_lock:
+            data = self._cover_bytes.get(key)
+            if data is not None:
+                self._cover_bytes.move_to_end(key)
+                return data
+        
+        try:
+            data = Path(cover_path).read_bytes()
+        except OSError as e:
+            logger.warning(f"Could not read cover {cover_path}: {e}")
+            return None
+        
+        with self._cover_bytes_lock:
+            self._cover_bytes[key] = data
+            if len(self._cover_bytes) > self.cover_bytes_cache_size:
+                self._cover_bytes.popitem(last=False)
+        return data
+    
+    def _forget_cover_bytes(self, series: str, volume: int):
+        """Drop cached cover bytes after the volume's cover file changed."""
+        with self._cover_bytes_lock:
+            self._cover_bytes.pop((series, volume), None)
+    
+    def copy_cover_to_cbz(self, cbz_path: Path, cover_source: Path,
+                          cover_data: Optional[bytes] = None) -> bool:
         """Add cover image to CBZ file.
         
         Args:
             cbz_path: Path to CBZ file
             cover_source: Path to cover image to add
+            cover_data: Cover image bytes, if already in memory
         
         Returns:
             True if successful
         """
         try:
             # Read cover image
-            with open(cover_source, 'rb') as f:
-                cover_data = f.read()
+            if cover_data is None:
+                with open(cover_source, 'rb') as f:
+                    cover_data = f.read()
             
             # Add to CBZ as 000_cover.jpg
-            cbz = CBZFile(cbz_path)
-            cbz.add_or_update_file('000_cover.jpg', cover_data)
+            with CBZFile(cbz_path) as cbz:
+                cbz.add_or_update_file('000_cover.jpg', cover_data)
             
             logger.info(f"Added cover to {cbz_path.name}")
             return True
@@ -182,15 +319,15 @@ class CoverManager:
             True if removed or didn't exist
         """
         try:
-            cbz = CBZFile(cbz_path)
+            # Most first chapters have no 000_cover.jpg; probe without a full open
+            if not CBZFile.has_file_fast(cbz_path, '000_cover.jpg'):
+                logger.debug(f"No 000_cover.jpg to remove from {cbz_path.name}")
+                return True
             
-            if cbz.has_file('000_cover.jpg'):
+            with CBZFile(cbz_path) as cbz:
                 cbz.remove_file('000_cover.jpg')
                 logger.info(f"Removed duplicate 000_cover.jpg from {cbz_path.name}")
                 return True
-            else:
-                logger.debug(f"No 000_cover.jpg to remove from {cbz_path.name}")
-                return True
                 
         except Exception as e:
             logger.error(f"Failed to remove duplicate cover from {cbz_path.name}: {e}")
@@ -267,7 +404,8 @@ class CoverManager:
             existing_cover = self.get_existing_cover(series, volume)
             
             if existing_cover:
-                added = self.copy_cover_to_cbz(cbz_path, existing_cover)
+                cover_data = self._get_cover_bytes(series, volume, existing_cover)
+                added = self.copy_cover_to_cbz(cbz_path, existing_cover, cover_data)
                 result['cover_added'] = added
                 result['cover_path'] = existing_cover
                 result['success'] = added
@@ -280,13 +418,16 @@ class CoverManager:
         
         return result
     
-    def save_uploaded_cover(self, series: str, volume: int, cover_data: bytes) -> Tuple[bool, Optional[Path], str]:
+    def save_uploaded_cover(self, series: str, volume: int,
+                            cover_data: Union[bytes, BinaryIO]) -> Tuple[bool, Optional[Path], str]:
         """Save manually uploaded cover.
         
         Args:
             series: Series name
             volume: Volume number
-            cover_data: Cover image data
+            cover_data: Cover image data, or a seekable binary file object
+                (e.g. an upload's stream), which is decoded without being
+                read into memory first
         
         Returns:
             Tuple of (success, cover_path, message)
@@ -294,18 +435,15 @@ class CoverManager:
         try:
             cover_path = self.get_cover_path(series, volume)
             
-            # Validate it's a valid image
-            img = Image.open(io.BytesIO(cover_data))
-            
-            # Convert to RGB and save as JPEG
-            if img.mode in ('RGBA', 'LA', 'P'):
-                rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = rgb_img
+            if isinstance(cover_data, (bytes, bytearray)):
+                cover_data = io.BytesIO(cover_data)
             
-            img.save(cover_path, 'JPEG', quality=95)
+            # Validate it's a valid image
+            with Image.open(cover_data) as img:
+                # Convert to RGB and save as JPEG
+                img = self._prepare_cover_image(img)
+                self._save_jpeg(img, cover_path)
+            self._forget_cover_bytes(series, volume)
             logger.info(f"Saved uploaded cover for {series} Vol.{volume}")
             
             return True, cover_path, "Cover uploaded successfully"
@@ -1,22 +1,221 @@
+import os
+import mmap
 import sqlite3
 import hashlib
+import itertools
+import threading
+import zipfile
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 
+from cbz_utils import page_manifest
+
+# Full-file hashing: block size fed to SHA256, and the size from which the
+# file is memory-mapped rather than read
+HASH_BLOCK_BYTES = 4 * 1024 * 1024
+HASH_MMAP_MIN_BYTES = 64 * 1024 * 1024
+
+# Files from this size have their pages dropped from the page cache once
+# hashed; later stages only re-read the central directory and a few entries
+HASH_DROP_CACHE_BYTES = 256 * 1024 * 1024
+
+# Full hashes remembered in memory, keyed on (path, mtime, size); the
+# file_hashes table keeps them across restarts for HASH_CACHE_DAYS
+HASH_CACHE_SIZE = 1024
+HASH_CACHE_DAYS = 30
+
+# Sampled fingerprint: one window each at the start, middle and end of the file
+SAMPLE_WINDOW_BYTES = 64 * 1024
+
+# Connection tuning: WAL lets readers run alongside the writer and only
+# checkpoints need a full fsync
+_PRAGMAS = '''
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA busy_timeout=5000;
+'''
+
+# Read-only connections (web UI reads) skip the journal setup, which needs
+# write access, and refuse writes outright
+_READ_PRAGMAS = '''
+    PRAGMA query_only=ON;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA busy_timeout=5000;
+'''
+
+# Statement text is kept constant so sqlite3's statement cache reuses the
+# prepared statements across calls
+_SQL_IS_DUPLICATE = 'SELECT id FROM processed_files WHERE file_hash = ?'
+
+# Every row that could hold the same bytes: same size, or recorded before
+# file_size existed
+_SQL_SIZE_CANDIDATES = '''
+    SELECT id, file_hash, quick_hash, file_path FROM processed_files 
+    WHERE file_size = ? OR file_size IS NULL
+'''
+
+# Fills in the full hash of a row stored without one
+_SQL_SET_FILE_HASH = '''
+    UPDATE processed_files SET file_hash = ? 
+    WHERE id = ? AND file_hash IS NULL
+'''
+
+_SQL_INSERT_FILE = '''
+    INSERT INTO processed_files 
+    (filename, series, volume, chapter, file_path, cover_path, file_hash, status, error_message,
+     file_size, quick_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_FILES_BY_SERIES = '''
+    SELECT * FROM processed_files 
+    WHERE series = ?
+    ORDER BY volume, chapter
+'''
+
+_SQL_FILES_BY_SERIES_STATUS = '''
+    SELECT * FROM processed_files 
+    WHERE series = ? AND status = ?
+    ORDER BY volume, chapter
+'''
+
+_SQL_VOLUME_COVER = '''
+    SELECT cover_path FROM processed_files 
+    WHERE series = ? AND volume = ? AND cover_path IS NOT NULL
+    LIMIT 1
+'''
+
+_SQL_NEEDS_REVIEW = '''
+    SELECT * FROM processed_files 
+    WHERE status = 'needs_review'
+    ORDER BY processed_date DESC
+'''
+
+_SQL_GET_FILE = 'SELECT * FROM processed_files WHERE id = ?'
+
+_SQL_UPDATE_FILE = '''
+    UPDATE processed_files 
+    SET series = ?, volume = ?, chapter = ?, status = 'completed'
+    WHERE id = ?
+'''
+
+# Without statistics the planner would pick idx_status and sort; the
+# partial index already holds these rows in order with every column.
+# Keyset pagination on id: each page seeks below the last id seen (the
+# first page's NULL cursor becomes the largest rowid, keeping the seek)
+_SQL_REVIEW_PAGE = '''
+    SELECT id, filename, series, volume, chapter, file_path, processed_date, error_message
+    FROM processed_files INDEXED BY idx_review_queue 
+    WHERE status = 'needs_review' AND id < coalesce(?, 9223372036854775807)
+    ORDER BY id DESC
+    LIMIT ?
+'''
+
+_SQL_UPDATE_STATUS = '''
+    UPDATE processed_files 
+    SET status = ?, error_message = ?
+    WHERE id = ?
+'''
+
+_SQL_CACHED_HASH = '''
+    SELECT file_hash FROM file_hashes 
+    WHERE path = ? AND mtime_ns = ? AND size = ?
+'''
+
+_SQL_STORE_HASH = '''
+    INSERT OR REPLACE INTO file_hashes (path, mtime_ns, size, file_hash)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Fresh hash states are copied from these rather than initialized per file
+_SHA256_EMPTY = hashlib.sha256()
+_BLAKE2B_16_EMPTY = hashlib.blake2b(digest_size=16)
+
+# Per-thread read buffer for hashing, allocated on a thread's first file
+_tls = threading.local()
+
+
+def _hash_buffer():
+    """Get the calling thread's HASH_BLOCK_BYTES read buffer."""
+    buffer = getattr(_tls, 'buffer', None)
+    if buffer is None:
+        buffer = _tls.buffer = bytearray(HASH_BLOCK_BYTES)
+    return buffer
+
+
+def _fadvise(fd, advice):
+    """Pass an access pattern hint (an os.POSIX_FADV_* name) for a whole file.
+    
+    Does nothing on platforms without posix_fadvise.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass
+
+
 class Database:
     """SQLite database for tracking processed manga files."""
     
     def __init__(self, db_path='/data/manga_manager.db'):
         self.db_path = db_path
-        self.conn = None
-        self._connect()
+        # Each thread (watcher, web UI, cover workers) gets its own connection
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._hash_cache = OrderedDict()
+        self._hash_cache_lock = threading.Lock()
+        # Bumped after every write to processed_files, so readers can tell
+        # whether results they cached are still current
+        self._versions = itertools.count(1)
+        self.version = 0
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         self._create_tables()
     
-    def _connect(self):
+    @property
+    def conn(self):
+        """Connection for the calling thread."""
+        return self.get_conn()
+    
+    def get_conn(self):
+        """Get the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def get_read_conn(self):
+        """Get the calling thread's read-only connection, opening it on first use.
+        
+        With WAL, reads on these connections run alongside the processor's
+        writes instead of waiting for them.
+        """
+        conn = getattr(self._local, 'read_conn', None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.read_conn = conn
+        return conn
+    
+    def _connect(self, read_only=False):
         """Connect to SQLite database."""
-        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
+        # Only used by the thread that opened it; check_same_thread is off so
+        # close() can shut down every thread's connection
+        if read_only:
+            uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_READ_PRAGMAS if read_only else _PRAGMAS)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
     
     def _create_tables(self):
         """Create database schema if not exists."""
@@ -35,14 +234,32 @@ class Database:
                 processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 file_hash TEXT UNIQUE,
                 status TEXT DEFAULT 'completed',
-                error_message TEXT
+                error_message TEXT,
+                file_size INTEGER,
+                quick_hash TEXT
             )
         ''')
         
+        # Add quick-key columns to databases created before they existed
+        columns = {row['name'] for row in cursor.execute('PRAGMA table_info(processed_files)')}
+        for column, column_type in (('file_size', 'INTEGER'), ('quick_hash', 'TEXT')):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE processed_files ADD COLUMN {column} {column_type}')
+        
         # Create indexes for faster lookups
+        # Covering index: get_volume_cover is answered without touching the table
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_series_volume 
-            ON processed_files(series, volume)
+            CREATE INDEX IF NOT EXISTS idx_series_volume_cover 
+            ON processed_files(series, volume, cover_path)
+        ''')
+        
+        # Superseded by idx_series_volume_cover, which has the same prefix
+        cursor.execute('DROP INDEX IF EXISTS idx_series_volume')
+        
+        # Serves the status-filtered series listing in ORDER BY order
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_series_status_vol_chap 
+            ON processed_files(series, status, volume, chapter)
         ''')
         
         cursor.execute('''
@@ -55,83 +272,303 @@ class Database:
             ON processed_files(status)
         ''')
         
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_size_quick_hash 
+            ON processed_files(file_size, quick_hash)
+        ''')
+        
+        # Review pages, answered from the index alone: only needs_review rows
+        # are indexed, keyed by id and carrying the columns _SQL_REVIEW_PAGE returns
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_review_queue 
+            ON processed_files(id DESC, filename, series, volume, chapter,
+                               file_path, processed_date, error_message, status)
+            WHERE status = 'needs_review'
+        ''')
+        
+        # Newest-first listing of recent files
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processed_date 
+            ON processed_files(processed_date DESC)
+        ''')
+        
+        # Hashes of files seen on earlier runs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                file_hash TEXT NOT NULL,
+                cached_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute(
+            "DELETE FROM file_hashes WHERE cached_date < datetime('now', ?)",
+            (f'-{HASH_CACHE_DAYS} days',)
+        )
+        
         self.conn.commit()
     
     def calculate_file_hash(self, file_path):
-        """Calculate SHA256 hash of file."""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
+        """Calculate SHA256 hash of file.
+        
+        Results are cached on (real path, mtime, size), in memory and in the
+        file_hashes table, so retries and restarts do not re-read unchanged
+        files.
+        """
+        path = os.path.realpath(file_path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        
+        with self._hash_cache_lock:
+            file_hash = self._hash_cache.get(key)
+            if file_hash is not None:
+                self._hash_cache.move_to_end(key)
+                return file_hash
+        
+        row = self.conn.execute(_SQL_CACHED_HASH, key).fetchone()
+        if row:
+            file_hash = row['file_hash']
+        else:
+            file_hash = self._hash_file(path)
+            conn = self.get_conn()
+            with conn:
+                conn.execute(_SQL_STORE_HASH, key + (file_hash,))
+        
+        with self._hash_cache_lock:
+            self._hash_cache[key] = file_hash
+            if len(self._hash_cache) > HASH_CACHE_SIZE:
+                self._hash_cache.popitem(last=False)
+        return file_hash
+    
+    def _hash_file(self, file_path):
+        """Calculate SHA256 hash of file contents.
+        
+        Data is fed to the hash in HASH_BLOCK_BYTES blocks, so memory use
+        does not grow with the file. Large files are hashed straight from a
+        memory map instead of being copied into a read buffer.
+        """
+        sha256_hash = _SHA256_EMPTY.copy()
+        with open(file_path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            # One front-to-back pass: let the kernel read ahead aggressively
+            _fadvise(f.fileno(), 'POSIX_FADV_SEQUENTIAL')
+            _fadvise(f.fileno(), 'POSIX_FADV_WILLNEED')
+            if size >= HASH_MMAP_MIN_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                        memoryview(mapped) as view:
+                    for start in range(0, size, HASH_BLOCK_BYTES):
+                        sha256_hash.update(view[start:start + HASH_BLOCK_BYTES])
+            else:
+                buffer = _hash_buffer()
+                view = memoryview(buffer)
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    sha256_hash.update(view[:n])
+            if size >= HASH_DROP_CACHE_BYTES:
+                _fadvise(f.fileno(), 'POSIX_FADV_DONTNEED')
         return sha256_hash.hexdigest()
     
+    def quick_fingerprint(self, file_path):
+        """Calculate a sampled duplicate-check fingerprint for a file.
+        
+        Hashes three SAMPLE_WINDOW_BYTES windows (start, middle, end), so
+        files that share their first pages still tell apart without reading
+        them whole.
+        
+        Returns:
+            Tuple of (file size, hash of the windows)
+        """
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            digest = _BLAKE2B_16_EMPTY.copy()
+            for offset in (0, size // 2 - SAMPLE_WINDOW_BYTES // 2, size - SAMPLE_WINDOW_BYTES):
+                digest.update(os.pread(fd, SAMPLE_WINDOW_BYTES, max(0, offset)))
+        finally:
+            os.close(fd)
+        return size, digest.hexdigest()
+    
+    def is_duplicate_fast(self, file_path, file_size, quick_hash):
+        """Check for a duplicate, hashing the whole file only when needed.
+        
+        Tiers: rows of the same size, then the sampled fingerprint, then the
+        full SHA256, which is only calculated when a row survives the first
+        two. A fingerprint match on a row stored without a full hash is
+        settled by that row's file, if it still exists: by its hash (written
+        back to the row when it matches) or, since processing adds metadata
+        and a cover, by its page manifest.
+        
+        Args:
+            file_path: File to check
+            file_size: Size from quick_fingerprint
+            quick_hash: Fingerprint from quick_fingerprint
+        
+        Returns:
+            Tuple of (is_duplicate, file_hash); file_hash is None when the
+            full hash was not needed
+        """
+        rows = self.conn.execute(_SQL_SIZE_CANDIDATES, (file_size,)).fetchall()
+        if not rows:
+            return False, None
+        
+        full_hash_candidates = set()
+        unhashed_matches = []  # (id, file_path) of matched rows without a hash
+        
+        for row_id, row_hash, row_quick, row_path in rows:
+            if row_quick is None:
+                # Recorded without a quick key: only the full hash can tell
+                if row_hash is not None:
+                    full_hash_candidates.add(row_hash)
+                continue
+            
+            if row_quick != quick_hash:
+                continue
+            
+            if row_hash is None:
+                unhashed_matches.append((row_id, row_path))
+            else:
+                full_hash_candidates.add(row_hash)
+        
+        if not full_hash_candidates and not unhashed_matches:
+            return False, None
+        
+        file_hash = self.calculate_file_hash(file_path)
+        if file_hash in full_hash_candidates:
+            return True, file_hash
+        
+        for row_id, row_path in unhashed_matches:
+            try:
+                row_hash = self.calculate_file_hash(row_path)
+            except (OSError, TypeError):
+                # File gone (or never recorded): nothing to compare against
+                continue
+            if row_hash == file_hash:
+                try:
+                    conn = self.get_conn()
+                    with conn:
+                        conn.execute(_SQL_SET_FILE_HASH, (row_hash, row_id))
+                except sqlite3.IntegrityError:
+                    # Another row already holds this hash
+                    pass
+                return True, file_hash
+            # A processed copy no longer hashes like its original
+            try:
+                if page_manifest(row_path) == page_manifest(file_path):
+                    return True, file_hash
+            except (OSError, zipfile.BadZipFile):
+                continue
+        
+        return False, file_hash
+    
     def is_duplicate(self, file_hash):
         """Check if file hash already exists in database."""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT id FROM processed_files WHERE file_hash = ?', (file_hash,))
-        return cursor.fetchone() is not None
+        return self.conn.execute(_SQL_IS_DUPLICATE, (file_hash,)).fetchone() is not None
     
     def add_processed_file(self, filename, series, volume, chapter, file_path, 
-                          cover_path, file_hash, status='completed', error_message=None):
+                          cover_path, file_hash, status='completed', error_message=None,
+                          file_size=None, quick_hash=None):
         """Add processed file to database."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO processed_files 
-            (filename, series, volume, chapter, file_path, cover_path, file_hash, status, error_message)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (filename, series, volume, chapter, file_path, cover_path, file_hash, status, error_message))
-        self.conn.commit()
+        conn = self.get_conn()
+        with conn:
+            cursor = conn.execute(_SQL_INSERT_FILE, (
+                filename, series, volume, chapter, file_path, cover_path, file_hash, status, error_message,
+                file_size, quick_hash
+            ))
+        self.version = next(self._versions)
         return cursor.lastrowid
     
+    def add_processed_files(self, records):
+        """Add several processed files in a single transaction.
+        
+        Args:
+            records: Iterable of dicts with the add_processed_file arguments
+                (status, error_message, file_size and quick_hash optional)
+        """
+        rows = [
+            (r['filename'], r['series'], r['volume'], r['chapter'], r['file_path'],
+             r['cover_path'], r['file_hash'], r.get('status', 'completed'), r.get('error_message'),
+             r.get('file_size'), r.get('quick_hash'))
+            for r in records
+        ]
+        conn = self.get_conn()
+        with conn:
+            conn.executemany(_SQL_INSERT_FILE, rows)
+        self.version = next(self._versions)
+    
     def get_files_by_series(self, series, status=None):
         """Get all processed files for a series."""
-        cursor = self.conn.cursor()
         if status:
-            cursor.execute('''
-                SELECT * FROM processed_files 
-                WHERE series = ? AND status = ?
-                ORDER BY volume, chapter
-            ''', (series, status))
-        else:
-            cursor.execute('''
-                SELECT * FROM processed_files 
-                WHERE series = ?
-                ORDER BY volume, chapter
-            ''', (series,))
-        return cursor.fetchall()
+            return self.conn.execute(_SQL_FILES_BY_SERIES_STATUS, (series, status)).fetchall()
+        return self.conn.execute(_SQL_FILES_BY_SERIES, (series,)).fetchall()
     
     def get_volume_cover(self, series, volume):
         """Get cover path for a specific volume."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT cover_path FROM processed_files 
-            WHERE series = ? AND volume = ? AND cover_path IS NOT NULL
-            LIMIT 1
-        ''', (series, volume))
-        result = cursor.fetchone()
+        result = self.conn.execute(_SQL_VOLUME_COVER, (series, volume)).fetchone()
         return result['cover_path'] if result else None
     
     def get_files_needing_review(self):
         """Get all files with status 'needs_review'."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM processed_files 
-            WHERE status = 'needs_review'
-            ORDER BY processed_date DESC
-        ''')
-        return cursor.fetchall()
+        return self.conn.execute(_SQL_NEEDS_REVIEW).fetchall()
+    
+    def get_file(self, file_id):
+        """Get one processed file by id, or None (read-only connection)."""
+        return self.get_read_conn().execute(_SQL_GET_FILE, (file_id,)).fetchone()
+    
+    def update_file_metadata(self, file_id, series, volume, chapter):
+        """Set a file's series, volume and chapter and mark it completed."""
+        conn = self.get_conn()
+        with conn:
+            conn.execute(_SQL_UPDATE_FILE, (series, volume, chapter, file_id))
+        self.version = next(self._versions)
+    
+    def get_review_page(self, limit, after_id=None):
+        """Get one page of files with status 'needs_review', newest first.
+        
+        Args:
+            limit: Maximum number of rows to return
+            after_id: Return only rows with an id below this one
+            
+        Returns:
+            List of rows carrying the review page's fields
+        """
+        return self.get_read_conn().execute(
+            _SQL_REVIEW_PAGE, (after_id, limit)
+        ).fetchall()
     
     def update_status(self, file_id, status, error_message=None):
         """Update file processing status."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE processed_files 
-            SET status = ?, error_message = ?
-            WHERE id = ?
-        ''', (status, error_message, file_id))
-        self.conn.commit()
+        conn = self.get_conn()
+        with conn:
+            conn.execute(_SQL_UPDATE_STATUS, (status, error_message, file_id))
+        self.version = next(self._versions)
+    
+    def release_thread(self):
+        """Close the calling thread's connections, if it opened any.
+        
+        Covers both the read-write and the read-only connection. For
+        short-lived threads (one per web request): without this their
+        connections stay open until close(). The next use from the thread
+        opens a new connection.
+        """
+        for name in ('conn', 'read_conn'):
+            conn = getattr(self._local, name, None)
+            if conn is None:
+                continue
+            setattr(self._local, name, None)
+            with self._connections_lock:
+                try:
+                    self._connections.remove(conn)
+                except ValueError:
+                    pass
+            conn.close()
     
     def close(self):
-        """Close database connection."""
-        if self.conn:
-            self.conn.close()
+        """Close every thread's database connection."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
@@ -1,4 +1,5 @@
-import shutil
+import os
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional, Tuple
 import logging
@@ -6,6 +7,7 @@ import logging
 from cbz_utils import CBZFile
 from metadata_handler import ComicInfo
 from filename_parser import FilenameParser, SeriesDetector
+from utils import move_file
 
 logger = logging.getLogger('manga-manager.renamer')
 
@@ -26,11 +28,12 @@ class FileRenamer:
         self.parser = FilenameParser()
         self.series_detector = SeriesDetector(manga_library_path)
     
-    def analyze_file(self, cbz_path: Path) -> dict:
+    def analyze_file(self, cbz_path: Path, cbz: Optional[CBZFile] = None) -> dict:
         """Analyze CBZ file and extract all available metadata.
         
         Args:
             cbz_path: Path to CBZ file
+            cbz: Already opened archive for cbz_path (left open)
         
         Returns:
             Dictionary with metadata from filename and ComicInfo.xml
@@ -38,6 +41,7 @@ class FileRenamer:
         result = {
             'filename_parsed': {},
             'comicinfo_data': {},
+            'comic_info': None,
             'series': None,
             'volume': None,
             'chapter': None,
@@ -51,16 +55,18 @@ class FileRenamer:
         
         # Try to read ComicInfo.xml
         try:
-            cbz = CBZFile(cbz_path)
-            if cbz.has_file('ComicInfo.xml'):
-                xml_content = cbz.read_file('ComicInfo.xml')
-                comic_info = ComicInfo(xml_content)
-                result['comicinfo_data'] = {
-                    'series': comic_info.series,
-                    'volume': comic_info.volume,
-                    'number': comic_info.number,
-                    'title': comic_info.title
-                }
+            with (nullcontext(cbz) if cbz else CBZFile(cbz_path)) as archive:
+                if archive.has_file('ComicInfo.xml'):
+                    xml_content = archive.read_file('ComicInfo.xml')
+                    comic_info = ComicInfo(xml_content)
+                    # Parsed document, reused by update_metadata
+                    result['comic_info'] = comic_info
+                    result['comicinfo_data'] = {
+                        'series': comic_info.series,
+                        'volume': comic_info.volume,
+                        'number': comic_info.number,
+                        'title': comic_info.title
+                    }
         except Exception as e:
             logger.warning(f"Could not read ComicInfo.xml from {cbz_path.name}: {e}")
             result['issues'].append(f"ComicInfo.xml read error: {e}")
@@ -107,18 +113,20 @@ class FileRenamer:
         return f"{standardized}.cbz"
     
     def rename_file(self, cbz_path: Path, dest_dir: Optional[Path] = None, 
-                   dry_run: bool = False) -> Tuple[bool, Path, list]:
+                   dry_run: bool = False, analysis: Optional[dict] = None) -> Tuple[bool, Path, list]:
         """Rename CBZ file to standardized format.
         
         Args:
             cbz_path: Path to CBZ file to rename
             dest_dir: Destination directory (if None, renames in place)
             dry_run: If True, don't actually rename, just return what would happen
+            analysis: Result of analyze_file for cbz_path, if already done
         
         Returns:
             Tuple of (success, new_path, issues)
         """
-        analysis = self.analyze_file(cbz_path)
+        if analysis is None:
+            analysis = self.analyze_file(cbz_path)
         
         if analysis['needs_review']:
             logger.warning(f"File needs review: {cbz_path.name}")
@@ -141,32 +149,43 @@ class FileRenamer:
             new_path = cbz_path.parent / new_filename
         
         # Check if file would overwrite itself
-        if cbz_path.resolve() == new_path.resolve():
+        if new_path.exists() and os.path.samefile(cbz_path, new_path):
             logger.info(f"File already has correct name: {cbz_path.name}")
             return True, new_path, []
         
-        # Check if destination exists
-        if new_path.exists() and not dry_run:
-            issue = f"Destination already exists: {new_filename}"
-            logger.error(issue)
-            return False, cbz_path, [issue]
-        
         if dry_run:
             logger.info(f"DRY RUN: Would rename '{cbz_path.name}' -> '{new_filename}'")
             return True, new_path, []
         
+        # Claim the destination name with O_EXCL before moving over it, so
+        # of two files renamed to the same name at once, one fails here
+        # instead of replacing the other
+        try:
+            os.close(os.open(new_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            issue = f"Destination already exists: {new_filename}"
+            logger.error(issue)
+            return False, cbz_path, [issue]
+        except OSError as e:
+            issue = f"Rename failed: {e}"
+            logger.error(issue)
+            return False, cbz_path, [issue]
+        
         # Perform rename/move
         try:
-            shutil.move(str(cbz_path), str(new_path))
+            move_file(cbz_path, new_path)
             logger.info(f"Renamed: '{cbz_path.name}' -> '{new_filename}'")
             return True, new_path, []
         except Exception as e:
+            new_path.unlink(missing_ok=True)
             issue = f"Rename failed: {e}"
             logger.error(issue)
             return False, cbz_path, [issue]
     
     def update_metadata(self, cbz_path: Path, series: str, volume: Optional[int], 
-                       chapter: float, preserve_existing: bool = True) -> bool:
+                       chapter: float, preserve_existing: bool = True,
+                       cbz: Optional[CBZFile] = None,
+                       comic_info: Optional[ComicInfo] = None) -> bool:
         """Update ComicInfo.xml metadata in CBZ file.
         
         Args:
@@ -175,36 +194,39 @@ class FileRenamer:
             volume: Volume number
             chapter: Chapter number
             preserve_existing: If True, only update missing fields
+            cbz: Already opened archive for cbz_path (left open)
+            comic_info: ComicInfo.xml already parsed from cbz_path, if any
         
         Returns:
             True if successful
         """
         try:
-            cbz = CBZFile(cbz_path)
-            
-            # Read existing ComicInfo.xml or create new
-            if cbz.has_file('ComicInfo.xml'):
-                xml_content = cbz.read_file('ComicInfo.xml')
-                comic_info = ComicInfo(xml_content)
-                logger.debug(f"Updating existing ComicInfo.xml in {cbz_path.name}")
-            else:
-                comic_info = ComicInfo()
-                logger.debug(f"Creating new ComicInfo.xml in {cbz_path.name}")
-            
-            # Update fields (respect preserve_existing)
-            if not preserve_existing or not comic_info.series:
-                comic_info.series = series
-            
-            if not preserve_existing or comic_info.volume is None:
-                if volume is not None:
-                    comic_info.volume = volume
-            
-            if not preserve_existing or comic_info.number is None:
-                comic_info.number = chapter
-            
-            # Write back to CBZ
-            xml_bytes = comic_info.to_xml()
-            cbz.add_or_update_file('ComicInfo.xml', xml_bytes)
+            with (nullcontext(cbz) if cbz else CBZFile(cbz_path)) as archive:
+                # Read existing ComicInfo.xml or create new
+                if comic_info is not None:
+                    logger.debug(f"Updating existing ComicInfo.xml in {cbz_path.name}")
+                elif archive.has_file('ComicInfo.xml'):
+                    xml_content = archive.read_file('ComicInfo.xml')
+                    comic_info = ComicInfo(xml_content)
+                    logger.debug(f"Updating existing ComicInfo.xml in {cbz_path.name}")
+                else:
+                    comic_info = ComicInfo()
+                    logger.debug(f"Creating new ComicInfo.xml in {cbz_path.name}")
+                
+                # Update fields (respect preserve_existing)
+                if not preserve_existing or not comic_info.series:
+                    comic_info.series = series
+                
+                if not preserve_existing or comic_info.volume is None:
+                    if volume is not None:
+                        comic_info.volume = volume
+                
+                if not preserve_existing or comic_info.number is None:
+                    comic_info.number = chapter
+                
+                # Write back to CBZ
+                xml_bytes = comic_info.to_xml()
+                archive.add_or_update_file('ComicInfo.xml', xml_bytes)
             
             logger.info(f"Updated metadata in {cbz_path.name}")
             return True
@@ -237,31 +259,44 @@ class FileRenamer:
             'issues': []
         }
         
-        # Analyze file
-        analysis = self.analyze_file(cbz_path)
-        result['analysis'] = analysis
-        result['needs_review'] = analysis['needs_review']
-        result['issues'] = analysis['issues'].copy()
-        
-        if analysis['needs_review']:
-            logger.warning(f"File needs manual review: {cbz_path.name}")
-            return result
+        # One archive handle serves both the analysis and the metadata update;
+        # if it cannot be opened, each step reports the error itself
+        try:
+            cbz = CBZFile(cbz_path)
+        except Exception:
+            cbz = None
         
-        # Update metadata if requested
-        if update_metadata:
-            metadata_success = self.update_metadata(
-                cbz_path,
-                analysis['series'],
-                analysis['volume'],
-                analysis['chapter'],
-                preserve_existing
-            )
-            result['metadata_updated'] = metadata_success
-            if not metadata_success:
-                result['issues'].append("Metadata update failed")
+        try:
+            # Analyze file
+            analysis = self.analyze_file(cbz_path, cbz)
+            result['analysis'] = analysis
+            result['needs_review'] = analysis['needs_review']
+            result['issues'] = analysis['issues'].copy()
+            
+            if analysis['needs_review']:
+                logger.warning(f"File needs manual review: {cbz_path.name}")
+                return result
+            
+            # Update metadata if requested
+            if update_metadata:
+                metadata_success = self.update_metadata(
+                    cbz_path,
+                    analysis['series'],
+                    analysis['volume'],
+                    analysis['chapter'],
+                    preserve_existing,
+                    cbz=cbz,
+                    comic_info=analysis['comic_info']
+                )
+                result['metadata_updated'] = metadata_success
+                if not metadata_success:
+                    result['issues'].append("Metadata update failed")
+        finally:
+            if cbz is not None:
+                cbz.close()
         
         # Rename file
-        rename_success, new_path, rename_issues = self.rename_file(cbz_path, dest_dir)
+        rename_success, new_path, rename_issues = self.rename_file(cbz_path, dest_dir, analysis=analysis)
         result['renamed'] = rename_success
         result['new_path'] = new_path
         result['issues'].extend(rename_issues)
@@ -1,4 +1,7 @@
+import heapq
 import logging
+import os
+import threading
 import time
 from pathlib import Path
 from watchdog.observers import Observer
@@ -6,6 +9,9 @@ from watchdog.events import FileSystemEventHandler
 
 logger = logging.getLogger('manga-manager.watcher')
 
+# Superseded heap entries tolerated before the pending heap is rebuilt
+HEAP_SLACK = 64
+
 class CBZFileHandler(FileSystemEventHandler):
     """Handler for CBZ file system events."""
     
@@ -18,41 +24,133 @@ class CBZFileHandler(FileSystemEventHandler):
         super().__init__()
         self.callback = callback
         self.debounce_seconds = debounce_seconds
-        self._pending_files = {}  # file_path: timestamp
+        self._pending_files = {}  # file_path: timestamp of latest event
+        # (ready_at, file_path), soonest first; entries superseded by a later
+        # event for the same file are skipped when popped
+        self._ready_heap = []
+        # Events arrive on the observer thread; the scheduler thread waits on
+        # this condition until the earliest entry is due
+        self._lock = threading.Condition()
+        # Held while callbacks run, so event processing and the startup scan
+        # never overlap
+        self.dispatch_lock = threading.Lock()
+        self._scheduler = None
+        self._stopping = False
+    
+    def _touch(self, file_path: str, closed: bool = False):
+        """Record an event for a file and schedule its debounce check.
+        
+        Args:
+            file_path: Path of the CBZ file
+            closed: The writer closed the file, so it is ready right away
+        """
+        now = time.time()
+        # A closed file counts as quiet for a full debounce already
+        timestamp = now - self.debounce_seconds if closed else now
+        with self._lock:
+            self._pending_files[file_path] = timestamp
+            heapq.heappush(self._ready_heap, (timestamp + self.debounce_seconds, file_path))
+            
+            # A file being written fires many modify events, each leaving a
+            # superseded entry behind; rebuild from the dict in one pass
+            # once those dominate the heap
+            if len(self._ready_heap) > 2 * len(self._pending_files) + HEAP_SLACK:
+                self._ready_heap = [
+                    (timestamp + self.debounce_seconds, path)
+                    for path, timestamp in self._pending_files.items()
+                ]
+                heapq.heapify(self._ready_heap)
+            
+            self._lock.notify()
+    
+    def start_scheduler(self):
+        """Start the thread that processes files as their debounce expires."""
+        if self._scheduler is not None:
+            return
+        self._stopping = False
+        self._scheduler = threading.Thread(target=self._run_scheduler, name='cbz-scheduler', daemon=True)
+        self._scheduler.start()
+    
+    def stop_scheduler(self):
+        """Stop the scheduler thread after any callback in progress."""
+        if self._scheduler is None:
+            return
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        self._scheduler.join()
+        self._scheduler = None
+    
+    def scheduler_running(self) -> bool:
+        """Check whether the scheduler thread is processing files."""
+        return self._scheduler is not None
+    
+    def _run_scheduler(self):
+        """Sleep until the next pending file is due, then check it."""
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    if self._ready_heap:
+                        delay = self._ready_heap[0][0] - time.time()
+                        if delay <= 0:
+                            break
+                        self._lock.wait(delay)
+                    else:
+                        # Idle: nothing wakes us until the next event
+                        self._lock.wait()
+                if self._stopping:
+                    return
+            
+            try:
+                self.check_pending_files()
+            except Exception as e:
+                logger.error(f"Pending file check failed: {e}", exc_info=True)
     
     def on_created(self, event):
         """Handle file creation events."""
-        if event.is_directory:
-            return
-        
-        file_path = Path(event.src_path)
-        
-        # Only process .cbz files
-        if file_path.suffix.lower() != '.cbz':
+        src = event.src_path
+        # Only process .cbz files; lower-casing the last four characters
+        # rejects noise events without copying the whole path
+        if event.is_directory or src[-4:].lower() != '.cbz':
             return
         
-        logger.info(f"New CBZ file detected: {file_path.name}")
-        self._pending_files[str(file_path)] = time.time()
+        logger.info(f"New CBZ file detected: {os.path.basename(src)}")
+        self._touch(src)
     
     def on_modified(self, event):
         """Handle file modification events (writing in progress)."""
-        if event.is_directory:
+        src = event.src_path
+        if event.is_directory or src[-4:].lower() != '.cbz':
             return
         
-        file_path = Path(event.src_path)
+        # Update timestamp for debouncing
+        self._touch(src)
+    
+    def on_closed(self, event):
+        """Handle close-after-write events (inotify IN_CLOSE_WRITE on Linux)."""
+        src = event.src_path
+        if event.is_directory or src[-4:].lower() != '.cbz':
+            return
         
-        if file_path.suffix.lower() == '.cbz':
-            # Update timestamp for debouncing
-            self._pending_files[str(file_path)] = time.time()
+        # Writing finished; no need to wait out the debounce
+        self._touch(src, closed=True)
     
     def check_pending_files(self):
         """Check if any pending files are ready for processing."""
         current_time = time.time()
         ready_files = []
+        retry = []
         
-        for file_path, timestamp in list(self._pending_files.items()):
-            # File hasn't been modified for debounce_seconds
-            if current_time - timestamp >= self.debounce_seconds:
+        with self._lock:
+            # Only entries whose debounce has run out are looked at
+            while self._ready_heap and self._ready_heap[0][0] <= current_time:
+                _, file_path = heapq.heappop(self._ready_heap)
+                timestamp = self._pending_files.get(file_path)
+                
+                # Already handled, or modified again since this entry was pushed
+                if timestamp is None or current_time - timestamp < self.debounce_seconds:
+                    continue
+                
                 path = Path(file_path)
                 
                 # Verify file still exists and is accessible
@@ -68,17 +166,23 @@ class CBZFileHandler(FileSystemEventHandler):
                         
                     except (IOError, PermissionError) as e:
                         logger.debug(f"File not ready yet: {path.name} - {e}")
+                        retry.append(file_path)
                 else:
                     # File was deleted before processing
                     logger.warning(f"File disappeared before processing: {file_path}")
                     del self._pending_files[file_path]
+            
+            # Files that could not be opened are tried again after another debounce
+            for file_path in retry:
+                heapq.heappush(self._ready_heap, (current_time + self.debounce_seconds, file_path))
         
         # Process ready files
-        for file_path in ready_files:
-            try:
-                self.callback(file_path)
-            except Exception as e:
-                logger.error(f"Error processing {file_path.name}: {e}", exc_info=True)
+        with self.dispatch_lock:
+            for file_path in ready_files:
+                try:
+                    self.callback(file_path)
+                except Exception as e:
+                    logger.error(f"Error processing {file_path.name}: {e}", exc_info=True)
 
 
 class FileWatcher:
@@ -110,6 +214,7 @@ class FileWatcher:
         
         self.observer.schedule(self.event_handler, str(self.watch_path), recursive=False)
         self.observer.start()
+        self.event_handler.start_scheduler()
         self.running = True
         
         logger.info(f"Started watching: {self.watch_path}")
@@ -119,29 +224,44 @@ class FileWatcher:
         if self.running:
             self.observer.stop()
             self.observer.join()
+            self.event_handler.stop_scheduler()
             self.running = False
             logger.info("File watcher stopped")
     
     def check_pending(self):
-        """Check for files that are ready to process."""
-        if self.running:
+        """Check for files that are ready to process.
+        
+        Only needed when polling; while the watcher runs, its scheduler
+        thread processes files as soon as their debounce expires.
+        """
+        if self.running and not self.event_handler.scheduler_running():
             self.event_handler.check_pending_files()
     
     def scan_existing_files(self):
-        """Scan for existing CBZ files in directory (on startup)."""
+        """Scan for existing CBZ files in directory (on startup).
+        
+        Files are handed to the callback in name order; new files seen
+        meanwhile wait until the backlog has been handed over.
+        """
         if not self.watch_path.exists():
             return
         
         logger.info("Scanning for existing CBZ files...")
-        cbz_files = list(self.watch_path.glob('*.cbz'))
+        # One readdir pass; the suffix check matches on_created's
+        with os.scandir(self.watch_path) as entries:
+            cbz_files = [
+                Path(entry.path) for entry in entries
+                if entry.name.lower().endswith('.cbz') and entry.is_file()
+            ]
         
         if cbz_files:
             logger.info(f"Found {len(cbz_files)} existing CBZ file(s)")
-            for cbz_file in cbz_files:
-                try:
-                    logger.info(f"Processing existing file: {cbz_file.name}")
-                    self.callback(cbz_file)
-                except Exception as e:
-                    logger.error(f"Error processing {cbz_file.name}: {e}", exc_info=True)
+            with self.event_handler.dispatch_lock:
+                for cbz_file in sorted(cbz_files):
+                    try:
+                        logger.info(f"Processing existing file: {cbz_file.name}")
+                        self.callback(cbz_file)
+                    except Exception as e:
+                        logger.error(f"Error processing {cbz_file.name}: {e}", exc_info=True)
         else:
             logger.info("No existing CBZ files found")
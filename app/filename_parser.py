@@ -1,10 +1,72 @@
+import os
 import re
+import threading
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 
 logger = logging.getLogger('manga-manager.parser')
 
+# Number of series-name lookups remembered by each SeriesDetector
+MATCH_CACHE_SIZE = 4096
+
+# (volume tag, chapter tag) pairs of the first two PATTERNS, lower-cased
+_SCAN_TAGS = (('vol.', 'ch.'), ('v', 'c'))
+_DIGITS = '0123456789'
+_CHAPTER_CHARS = '0123456789.'
+
+# Leading "[Group Name]" tag in a series name
+_GROUP_PREFIX_RE = re.compile(r'^\[.+?\]\s*')
+
+_GROUP_NAME_RE = re.compile(r'\(\?P<(\w+)>')
+
+
+def _stem(filename: str) -> str:
+    """Path(filename).stem without building a Path for bare filenames."""
+    if '/' in filename or filename == '.':
+        return Path(filename).stem
+    
+    # Same rule as PurePath.suffix: a leading or trailing dot is no suffix
+    dot = filename.rfind('.')
+    if 0 < dot < len(filename) - 1:
+        return filename[:dot]
+    return filename
+
+
+@lru_cache(maxsize=None)
+def _compile_patterns(patterns: Tuple[str, ...]):
+    """Compile filename patterns.
+    
+    Returns:
+        Tuple of (per-pattern regexes, combined regex, branch groups). The
+        combined regex joins all patterns into one alternation so a single
+        match call tries them in order; group names get the branch index
+        appended (series0, volume0, chapter0, ...) to keep them unique.
+        Branch groups map the index of each branch's last group to its
+        (series, volume, chapter) group names.
+    """
+    compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+    
+    branches = [_GROUP_NAME_RE.sub(rf'(?P<\g<1>{i}>', p) for i, p in enumerate(patterns)]
+    combined = re.compile('|'.join(f'(?:{b})' for b in branches), re.IGNORECASE)
+    
+    # Every branch ends with its chapter group, so the last group that
+    # took part in a match identifies the branch
+    branch_groups = {}
+    for i, p in enumerate(patterns):
+        names = _GROUP_NAME_RE.findall(p)
+        last = combined.groupindex[f'{names[-1]}{i}']
+        branch_groups[last] = tuple(
+            f'{field}{i}' if field in names else None
+            for field in ('series', 'volume', 'chapter')
+        )
+    
+    return compiled, combined, branch_groups
+
+
 class FilenameParser:
     """Parse manga filenames to extract series, volume, and chapter information."""
     
@@ -30,7 +92,9 @@ class FilenameParser:
     ]
     
     def __init__(self):
-        self.compiled_patterns = [re.compile(p, re.IGNORECASE) for p in self.PATTERNS]
+        # Compiled once per process and shared by every parser instance
+        self.compiled_patterns, self._combined, self._branch_groups = \
+            _compile_patterns(tuple(self.PATTERNS))
     
     def parse(self, filename: str) -> Dict[str, Any]:
         """Parse filename to extract metadata.
@@ -42,7 +106,7 @@ class FilenameParser:
             Dictionary with keys: series, volume, chapter, original_filename
         """
         # Remove .cbz extension
-        name = Path(filename).stem
+        name = _stem(filename)
         
         result = {
             'series': None,
@@ -51,32 +115,102 @@ class FilenameParser:
             'original_filename': filename
         }
         
-        # Try each pattern
-        for pattern in self.compiled_patterns:
-            match = pattern.match(name)
-            if match:
-                groups = match.groupdict()
-                
-                # Extract series name and clean it
-                if 'series' in groups:
-                    result['series'] = self._clean_series_name(groups['series'])
-                
-                # Extract volume number
-                if 'volume' in groups and groups['volume']:
-                    result['volume'] = int(groups['volume'])
-                
-                # Extract chapter number (can be decimal like 76.5)
-                if 'chapter' in groups and groups['chapter']:
-                    chapter = groups['chapter']
-                    result['chapter'] = float(chapter) if '.' in chapter else int(chapter)
-                
-                logger.debug(f"Parsed '{filename}' -> {result}")
-                return result
+        # The scanner handles the two common tagged layouts; anything else
+        # goes through the regex patterns
+        fields = self._fast_parse(name) or self._regex_parse(name)
+        if fields:
+            series, volume, chapter = fields
+            
+            # Extract series name and clean it
+            if series is not None:
+                result['series'] = self._clean_series_name(series)
+            
+            # Extract volume number
+            if volume:
+                result['volume'] = int(volume)
+            
+            # Extract chapter number (can be decimal like 76.5)
+            if chapter:
+                result['chapter'] = float(chapter) if '.' in chapter else int(chapter)
+            
+            logger.debug(f"Parsed '{filename}' -> {result}")
+            return result
         
         # No pattern matched
         logger.warning(f"Could not parse filename: {filename}")
         return result
     
+    def _regex_parse(self, name: str) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        """Match name against PATTERNS, in order.
+        
+        Returns:
+            Tuple of raw (series, volume, chapter) strings, or None
+        """
+        match = self._combined.match(name)
+        if not match:
+            return None
+        
+        series_group, volume_group, chapter_group = self._branch_groups[match.lastindex]
+        return (
+            match.group(series_group) if series_group else None,
+            match.group(volume_group) if volume_group else None,
+            match.group(chapter_group) if chapter_group else None,
+        )
+    
+    def _fast_parse(self, name: str) -> Optional[Tuple[str, str, str]]:
+        """Scan name for the "Vol.N Ch.N" and "vN cN" layouts without regex.
+        
+        Gives the same result as the first two PATTERNS. Names the scanner
+        cannot treat exactly like the regex engine (non-ASCII case folding,
+        newlines) are left to _regex_parse.
+        
+        Returns:
+            Tuple of raw (series, volume, chapter) strings, or None
+        """
+        if not name.isascii() or '\n' in name:
+            return None
+        
+        lower = name.lower()
+        for volume_tag, chapter_tag in _SCAN_TAGS:
+            fields = self._scan_tagged(name, lower, volume_tag, chapter_tag)
+            if fields:
+                return fields
+        return None
+    
+    @staticmethod
+    def _scan_tagged(name: str, lower: str, volume_tag: str,
+                     chapter_tag: str) -> Optional[Tuple[str, str, str]]:
+        """Find "<series> <volume_tag>N <chapter_tag>N" in name.
+        
+        Candidates are tried left to right, which picks the same (shortest)
+        series as the lazy regex group.
+        """
+        length = len(lower)
+        tag = lower.find(volume_tag, 2)
+        while tag != -1:
+            # Tag must follow whitespace; spans are measured with C-level
+            # strips rather than per-character loops
+            if lower[tag - 1].isspace():
+                pos = tag + len(volume_tag)
+                rest = lower[pos:].lstrip(_DIGITS)
+                after_gap = rest.lstrip()
+                
+                if (len(after_gap) < len(rest) < length - pos
+                        and after_gap.startswith(chapter_tag)):
+                    chapter = after_gap[len(chapter_tag):]
+                    chapter_start = length - len(chapter)
+                    chapter_end = length - len(chapter.lstrip(_CHAPTER_CHARS))
+                    
+                    if chapter_end > chapter_start:
+                        # Series ends where the whitespace run before the tag
+                        # starts, keeping at least one character
+                        start = max(1, len(lower[:tag].rstrip()))
+                        return (name[:start], name[pos:length - len(rest)],
+                                name[chapter_start:chapter_end])
+            
+            tag = lower.find(volume_tag, tag + 1)
+        return None
+    
     def _clean_series_name(self, series: str) -> str:
         """Clean up series name.
         
@@ -89,10 +223,12 @@ class FilenameParser:
         # Remove leading/trailing whitespace
         series = series.strip()
         
-        # Remove common prefixes like [Group Name]
-        series = re.sub(r'^\[.+?\]\s*', '', series)
+        # Remove common prefixes like [Group Name]; the regex only runs
+        # when there can be one
+        if series.startswith('['):
+            series = _GROUP_PREFIX_RE.sub('', series, count=1)
         
-        # Remove trailing dashes/underscores
+        # Remove trailing dashes/underscores (str.rstrip beats a [ -_]+$ regex)
         series = series.rstrip(' -_')
         
         return series
@@ -117,8 +253,9 @@ class FilenameParser:
         # Format chapter with padding (handle decimals like 76.5)
         if isinstance(chapter, float) and chapter % 1 != 0:
             # Decimal chapter (e.g., 76.5)
+            # Digits after the point exactly as the float prints them (76.25 -> "25")
             whole = int(chapter)
-            decimal = str(chapter).split('.')[1]
+            decimal = repr(chapter).partition('.')[2]
             ch_str = f"Ch.{whole:0{chapter_digits}d}.{decimal}"
         else:
             # Integer chapter
@@ -127,6 +264,95 @@ class FilenameParser:
         return f"{series} {vol_str} {ch_str}"
 
 
+class _SeriesAutomaton:
+    """Aho-Corasick automaton over lower-cased series names.
+    
+    One pass over an input string finds every library series contained in
+    it, instead of one substring test per series.
+    """
+    
+    def __init__(self, names: List[str]):
+        """
+        Args:
+            names: Lower-cased series names; matches report list indices
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        
+        # Trie of all names
+        for index, name in enumerate(names):
+            if not name:
+                continue
+            state = 0
+            for char in name:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][char] = nxt
+                state = nxt
+            self._out[state] += (index,)
+        
+        # Failure links, breadth first so shallower states are done first
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fallback = self._goto[fallback].get(char, 0)
+                self._fail[nxt] = fallback
+                self._out[nxt] += self._out[fallback]
+    
+    def find_all(self, text: str) -> set:
+        """Get indices of all names occurring in text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class _SeriesIndex:
+    """Lookup structures for one listing of the library's series."""
+    
+    def __init__(self, names: List[str], version: int):
+        """
+        Args:
+            names: Series directory names, in listing order
+            version: Listing number, used to key cached matches
+        """
+        self.names = names
+        self.version = version
+        self.lower = [name.lower() for name in names]
+        
+        # First listed series wins when names differ only in case
+        self.lower_to_original = {}
+        for name, lower in zip(names, self.lower):
+            self.lower_to_original.setdefault(lower, name)
+        
+        # All names joined by NUL (which no file name contains) for one
+        # C-level "input contained in a name" search
+        self.haystack = '\0'.join(self.lower)
+        self.starts = []
+        offset = 0
+        for lower in self.lower:
+            self.starts.append(offset)
+            offset += len(lower) + 1
+        
+        self.automaton = None
+
+
 class SeriesDetector:
     """Detect and match series names against existing library."""
     
@@ -136,7 +362,40 @@ class SeriesDetector:
             manga_library_path: Path to manga library directory
         """
         self.library_path = Path(manga_library_path)
-        self._series_cache = None
+        # Guards the caches below; matches can run on several scan workers
+        self._lock = threading.RLock()
+        # Current listing; replaced as a whole so a match never mixes two
+        self._index = None
+        # Bumped whenever the series list is rebuilt
+        self._version = 0
+        # (lower-cased input, version) -> match result; a match computed
+        # against an older list can never be served for a newer one
+        self._match_cache = {}
+    
+    def _get_index(self) -> _SeriesIndex:
+        """Get the current series listing, scanning the library if needed."""
+        index = self._index
+        if index is not None:
+            return index
+        
+        with self._lock:
+            if self._index is not None:
+                return self._index
+            
+            if self.library_path.exists():
+                # DirEntry.is_dir() uses the type readdir already returned
+                with os.scandir(self.library_path) as entries:
+                    series = [
+                        entry.name for entry in entries
+                        if not entry.name.startswith('.') and entry.is_dir()
+                    ]
+            else:
+                series = []
+            
+            self._version += 1
+            self._match_cache.clear()
+            self._index = _SeriesIndex(series, self._version)
+            return self._index
     
     def get_existing_series(self) -> list:
         """Get list of existing series in library.
@@ -144,16 +403,20 @@ class SeriesDetector:
         Returns:
             List of series names (directory names)
         """
-        if self._series_cache is None:
-            if self.library_path.exists():
-                self._series_cache = [
-                    d.name for d in self.library_path.iterdir() 
-                    if d.is_dir() and not d.name.startswith('.')
-                ]
-            else:
-                self._series_cache = []
-        
-        return self._series_cache
+        return self._get_index().names
+    
+    def invalidate(self):
+        """Forget the cached series list, e.g. after a series directory was created."""
+        with self._lock:
+            self._index = None
+    
+    def _get_automaton(self, index: _SeriesIndex) -> _SeriesAutomaton:
+        """Get the automaton for a listing, building it on first use."""
+        if index.automaton is None:
+            with self._lock:
+                if index.automaton is None:
+                    index.automaton = _SeriesAutomaton(index.lower)
+        return index.automaton
     
     def find_series_match(self, series_name: str) -> Optional[str]:
         """Find matching series in library.
@@ -166,22 +429,52 @@ class SeriesDetector:
         Returns:
             Matched series name from library, or None if no match
         """
-        existing = self.get_existing_series()
+        index = self._get_index()
+        
+        # Matching is case-insensitive, so case variants share one entry
+        series_lower = series_name.lower()
+        key = (series_lower, index.version)
+        try:
+            return self._match_cache[key]
+        except KeyError:
+            pass
+        
+        match = self._match_series(series_name, series_lower, index)
+        with self._lock:
+            # Skip storing if the list was rebuilt while matching
+            if index.version == self._version:
+                if len(self._match_cache) >= MATCH_CACHE_SIZE:
+                    # Drop the oldest entry
+                    del self._match_cache[next(iter(self._match_cache))]
+                self._match_cache[key] = match
+        return match
+    
+    def _match_series(self, series_name: str, series_lower: str,
+                      index: _SeriesIndex) -> Optional[str]:
+        """Match a series name against one listing, without the cache."""
+        existing = index.names
         
         # Exact match (case-insensitive)
-        for existing_series in existing:
-            if existing_series.lower() == series_name.lower():
-                return existing_series
+        hit = index.lower_to_original.get(series_lower)
+        if hit:
+            return hit
         
         # Fuzzy match (simple substring matching)
-        series_lower = series_name.lower()
-        for existing_series in existing:
-            existing_lower = existing_series.lower()
-            
-            # Check if one is substring of the other
-            if series_lower in existing_lower or existing_lower in series_lower:
-                logger.info(f"Fuzzy matched '{series_name}' to '{existing_series}'")
-                return existing_series
+        # Library series contained in the input, found in one pass
+        contained = self._get_automaton(index).find_all(series_lower)
+        first_match = min(contained) if contained else len(existing)
+        
+        # Series containing the input; the first hit in the joined names
+        # belongs to the earliest listed series
+        if existing and '\0' not in series_lower:
+            pos = index.haystack.find(series_lower)
+            if pos != -1:
+                first_match = min(first_match, bisect_right(index.starts, pos) - 1)
+        
+        if first_match < len(existing):
+            existing_series = existing[first_match]
+            logger.info(f"Fuzzy matched '{series_name}' to '{existing_series}'")
+            return existing_series
         
         # No match found
         logger.info(f"No existing series match for '{series_name}'")
@@ -6,10 +6,13 @@ Monitors download directory for new CBZ files and processes them through
 a complete pipeline from downloads to final library.
 """
 
-import time
+import os
 import signal
+import logging
 import shutil
 import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from config import Config
@@ -18,7 +21,17 @@ from file_watcher import FileWatcher
 from file_renamer import FileRenamer
 from cover_manager import CoverManager
 from web_ui import WebUI
-from utils import setup_logging, ensure_directory
+from utils import setup_logging, ensure_directory, move_file, unique_path, reserve_path
+
+# Separator around each file's log output
+_BANNER = '=' * 80
+
+# processed_files.series is NOT NULL; rows for files without a detected
+# series (failed, or unparseable and awaiting review) store this instead
+NO_SERIES = ''
+
+# Files processed at once; cover extraction and zip rewrites release the GIL
+PROCESS_WORKERS = min(8, os.cpu_count() or 1)
 
 class MangaManager:
     """Main application coordinator - integrates all components."""
@@ -28,19 +41,49 @@ class MangaManager:
         self.logger = setup_logging(self.config.log_level, '/logs/processor.log')
         self.db = Database()
         self.running = True
+        # Set by the signal handler; the main loop waits on it instead of
+        # sleeping, so shutdown is immediate
+        self._stop = threading.Event()
+        # Wakes the main loop for queued records and shutdown
+        self._wakeup = threading.Event()
+        
+        # Worker pool for incoming files. Files with the same parsed
+        # (series, volume) queue up behind each other in _file_queues.
+        self._executor = ThreadPoolExecutor(max_workers=PROCESS_WORKERS, thread_name_prefix='process')
+        self._file_queues = {}
+        self._queue_lock = threading.Lock()
+        # Serializes duplicate checks, moves into processing and DB writes
+        self._db_lock = threading.Lock()
+        # processed_files rows waiting for the next flush(), written in one
+        # transaction; guarded by _db_lock
+        self._pending_records = []
+        # Accepted files whose row is not queued yet: (size, fingerprint) ->
+        # Event set once it is; guarded by _db_lock
+        self._in_flight = {}
+        # One lock per detected (series, volume), held from cover handling
+        # until the file is in the library
+        self._volume_locks = defaultdict(threading.Lock)
         
         signal.signal(signal.SIGTERM, self._signal_handler)
         signal.signal(signal.SIGINT, self._signal_handler)
         
         self.logger.info("Manga Manager started")
+        
+        # Pipeline directories, resolved once
+        paths = self.config.paths
+        self._data_dir = Path(paths.get('data', '/data'))
+        self._processing_dir = Path(paths.get('processing', '/processing'))
+        self._failed_dir = self._processing_dir / 'failed'
+        self._manga_dir = Path(paths.get('manga', '/manga'))
+        # Backups go to a per-series folder under the processing directory
+        self._backup_dir = self._processing_dir
         self._initialize_directories()
         
         # Initialize processors
-        manga_path = self.config.paths.get('manga', '/manga')
-        covers_path = Path(self.config.paths.get('data', '/data')) / 'covers'
+        covers_path = self._data_dir / 'covers'
         
         self.file_renamer = FileRenamer(
-            manga_library_path=manga_path,
+            manga_library_path=self._manga_dir,
             volume_digits=self.config.naming.get('volume_digits', 3),
             chapter_digits=self.config.naming.get('chapter_digits', 5)
         )
@@ -50,7 +93,7 @@ class MangaManager:
         downloads_path = self.config.paths.get('downloads', '/downloads')
         self.file_watcher = FileWatcher(
             watch_path=downloads_path,
-            callback=self.process_file,
+            callback=self.submit_file,
             debounce_seconds=2
         )
         
@@ -60,33 +103,77 @@ class MangaManager:
     def _signal_handler(self, signum, frame):
         self.logger.info(f"Received signal {signum}, shutting down...")
         self.running = False
+        self._stop.set()
+        self._wakeup.set()
     
     def _initialize_directories(self):
-        paths = self.config.paths
-        data_dir = Path(paths.get('data', '/data'))
-        ensure_directory(data_dir / 'covers')
-        processing_dir = Path(paths.get('processing', '/processing'))
-        ensure_directory(processing_dir / 'failed')
+        ensure_directory(self._data_dir / 'covers')
+        ensure_directory(self._failed_dir)
         self.logger.info("Directory structure initialized")
     
+    def submit_file(self, file_path: Path):
+        """Queue a CBZ file for processing on the worker pool.
+        
+        Files that parse to the same series and volume are processed one
+        after another, in the order they were submitted.
+        
+        Args:
+            file_path: CBZ file in the downloads directory
+        """
+        key = self._file_key(file_path)
+        with self._queue_lock:
+            queue = self._file_queues.get(key)
+            if queue is not None:
+                queue.append(file_path)
+                return
+            self._file_queues[key] = deque([file_path])
+        self._executor.submit(self._drain_queue, key)
+    
+    def _drain_queue(self, key):
+        """Process queued files for one key until its queue is empty."""
+        while True:
+            with self._queue_lock:
+                queue = self._file_queues[key]
+                if not queue:
+                    del self._file_queues[key]
+                    return
+                file_path = queue.popleft()
+            try:
+                self.process_file(file_path)
+            except Exception as e:
+                self.logger.error(f"Error: {file_path.name}: {e}", exc_info=True)
+    
     def process_file(self, file_path: Path):
         """Complete processing pipeline for a CBZ file."""
-        self.logger.info(f"{'='*80}\nStarting processing: {file_path.name}\n{'='*80}")
+        # INFO lines below are formatted only when they will be logged
+        verbose = self.logger.isEnabledFor(logging.INFO)
+        if verbose:
+            self.logger.info(f"{_BANNER}\nStarting processing: {file_path.name}\n{_BANNER}")
         
+        fingerprint = None
+        processing_path = None
+        # Where the file is now, for moving it to failed/ on an error
+        current_path = file_path
         try:
-            # Duplicate check
-            file_hash = self.db.calculate_file_hash(file_path)
-            if self.db.is_duplicate(file_hash):
+            is_duplicate, fingerprint, processing_path = self._check_in(file_path)
+            
+            if is_duplicate:
                 self.logger.warning(f"Duplicate: {file_path.name}")
-                self._move_to_failed(file_path, "Duplicate file")
+                # The original's row already holds the (UNIQUE) hash; this row
+                # keeps only the size, so it is never a duplicate candidate
+                self._move_to_failed(file_path, "Duplicate file", {
+                    'file_hash': None, 'file_size': fingerprint['file_size'], 'quick_hash': None,
+                })
                 return
             
-            self.logger.info(f"Hash: {file_hash[:16]}...")
-            
-            # Move to processing
-            processing_path = self._move_to_processing(file_path)
             if not processing_path:
                 return
+            current_path = processing_path
+            
+            # The full hash is only calculated when the duplicate check needs
+            # it; rows without one are settled against their file later
+            if verbose:
+                self.logger.info(f"Hash: {(fingerprint['file_hash'] or fingerprint['quick_hash'])[:16]}...")
             
             # Analyze and rename
             self.logger.info("Analyzing metadata...")
@@ -98,82 +185,136 @@ class MangaManager:
             
             if rename_result['needs_review']:
                 self.logger.warning(f"Needs review: {', '.join(rename_result['issues'])}")
-                self._mark_for_review(processing_path, rename_result, file_hash)
+                self._mark_for_review(processing_path, rename_result, fingerprint)
                 return
             
             current_path = rename_result['new_path']
             analysis = rename_result['analysis']
-            self.logger.info(f"Detected: {analysis['series']} Vol.{analysis['volume']} Ch.{analysis['chapter']}")
-            
-            # Process cover
-            self.logger.info("Processing cover...")
-            cover_result = self.cover_manager.process_cover(
-                current_path, analysis['series'], analysis['volume'], analysis['chapter']
-            )
-            
-            if cover_result['needs_review']:
-                self.logger.warning(f"Cover issue: {cover_result['message']}")
-                self._mark_for_review(current_path, rename_result, file_hash, cover_result['message'])
-                return
-            
-            self.logger.info(f"Cover: {cover_result['message']}")
+            if verbose:
+                self.logger.info(f"Detected: {analysis['series']} Vol.{analysis['volume']} Ch.{analysis['chapter']}")
             
-            # Move to library
-            final_path = self._move_to_library(current_path, analysis['series'])
-            if not final_path:
-                self._mark_for_review(current_path, rename_result, file_hash, "Move failed")
-                return
+            with self._volume_lock(analysis['series'], analysis['volume']):
+                # Process cover
+                self.logger.info("Processing cover...")
+                cover_result = self.cover_manager.process_cover(
+                    current_path, analysis['series'], analysis['volume'], analysis['chapter']
+                )
+                
+                if cover_result['needs_review']:
+                    self.logger.warning(f"Cover issue: {cover_result['message']}")
+                    self._mark_for_review(current_path, rename_result, fingerprint, cover_result['message'])
+                    return
+                
+                if verbose:
+                    self.logger.info(f"Cover: {cover_result['message']}")
+                
+                # Move to library
+                final_path = self._move_to_library(current_path, analysis['series'])
+                if not final_path:
+                    self._mark_for_review(current_path, rename_result, fingerprint, "Move failed")
+                    return
+                # In the library now; a later error leaves it there
+                current_path = None
             
             # Backup if enabled
             if self.config.processing.get('backup_enabled', False):
                 self._create_backup(final_path, analysis['series'])
             
             # Record success
-            self.db.add_processed_file(
+            self._record(
                 filename=file_path.name, series=analysis['series'],
                 volume=analysis['volume'], chapter=analysis['chapter'],
                 file_path=str(final_path),
                 cover_path=str(cover_result.get('cover_path')) if cover_result.get('cover_path') else None,
-                file_hash=file_hash, status='completed'
+                status='completed', **fingerprint
             )
             
-            self.logger.info(f"✓ Success: {final_path.name}\n✓ Location: {final_path}")
+            if verbose:
+                self.logger.info(f"✓ Success: {final_path.name}\n✓ Location: {final_path}")
             
         except Exception as e:
             self.logger.error(f"Error: {file_path.name}: {e}", exc_info=True)
-            self._move_to_failed(file_path, str(e))
+            if current_path is not None:
+                self._move_to_failed(current_path, str(e), fingerprint, filename=file_path.name)
+        finally:
+            if processing_path:
+                self._check_out(fingerprint)
+    
+    def _check_in(self, file_path: Path):
+        """Check a file for duplicates and move a new one to processing.
+        
+        A file moved to processing stays in _in_flight until _check_out,
+        once its row is queued. A file with the same size and fingerprint
+        arriving meanwhile waits for that row and is then checked against it,
+        as if the two had been processed one after the other.
+        
+        Returns:
+            Tuple of (is_duplicate, fingerprint, processing path); the path
+            is None for a duplicate or when the move failed
+        """
+        key = None
+        while True:
+            with self._db_lock:
+                if key is None:
+                    key = self.db.quick_fingerprint(file_path)
+                waiting_for = self._in_flight.get(key)
+                if waiting_for is None:
+                    file_size, quick_hash = key
+                    # Duplicate check: size, then sampled fingerprint, then full
+                    # hash. Unflushed rows of this size could be the same file.
+                    if any(r.get('file_size') in (file_size, None) for r in self._pending_records):
+                        self._flush_records()
+                    is_duplicate, file_hash = self.db.is_duplicate_fast(file_path, file_size, quick_hash)
+                    fingerprint = {'file_hash': file_hash, 'file_size': file_size, 'quick_hash': quick_hash}
+                    processing_path = None
+                    if not is_duplicate:
+                        processing_path = self._move_to_processing(file_path)
+                        if processing_path:
+                            self._in_flight[key] = threading.Event()
+                    return is_duplicate, fingerprint, processing_path
+            waiting_for.wait()
+    
+    def _check_out(self, fingerprint: dict):
+        """Release a file registered by _check_in; its row is queued."""
+        with self._db_lock:
+            event = self._in_flight.pop((fingerprint['file_size'], fingerprint['quick_hash']), None)
+        if event is not None:
+            event.set()
     
     def _move_to_processing(self, file_path: Path):
         try:
-            processing_dir = Path(self.config.paths.get('processing', '/processing'))
-            ensure_directory(processing_dir)
-            dest_path = processing_dir / file_path.name
-            
-            if dest_path.exists():
-                base, suffix, counter = dest_path.stem, dest_path.suffix, 1
-                while dest_path.exists():
-                    dest_path = processing_dir / f"{base}_{counter}{suffix}"
-                    counter += 1
-            
-            shutil.move(str(file_path), str(dest_path))
+            ensure_directory(self._processing_dir)
+            dest_path = self._move_into(file_path, self._processing_dir)
             self.logger.info(f"→ Processing: {dest_path.name}")
             return dest_path
         except Exception as e:
             self.logger.error(f"Move to processing failed: {e}")
             return None
     
+    def _move_into(self, file_path: Path, directory: Path) -> Path:
+        """Move a file into directory under a name no other file gets."""
+        dest_path = reserve_path(directory, file_path.name)
+        try:
+            move_file(file_path, dest_path)
+        except Exception:
+            dest_path.unlink(missing_ok=True)
+            raise
+        return dest_path
+    
     def _move_to_library(self, file_path: Path, series: str):
         try:
-            manga_dir = Path(self.config.paths.get('manga', '/manga'))
-            series_dir = manga_dir / series
-            ensure_directory(series_dir)
+            series_dir = self._manga_dir / series
+            if not series_dir.is_dir():
+                ensure_directory(series_dir)
+                # Later files of this series should match the new directory
+                self.file_renamer.series_detector.invalidate()
             dest_path = series_dir / file_path.name
             
             if dest_path.exists():
                 self.logger.warning(f"Already exists: {dest_path.name}")
                 return None
             
-            shutil.move(str(file_path), str(dest_path))
+            move_file(file_path, dest_path)
             self.logger.info(f"→ Library: {dest_path}")
             return dest_path
         except Exception as e:
@@ -182,63 +323,107 @@ class MangaManager:
     
     def _create_backup(self, file_path: Path, series: str):
         try:
-            backup_dir = Path(self.config.paths.get('processing', '/processing')) / series
+            backup_dir = self._backup_dir / series
             ensure_directory(backup_dir)
-            shutil.copy2(str(file_path), str(backup_dir / file_path.name))
+            # Contents only: copyfile uses sendfile() on Linux and the backup
+            # does not need the timestamps and mode copy2 would add
+            shutil.copyfile(file_path, backup_dir / file_path.name)
             self.logger.info(f"Backup created")
         except Exception as e:
             self.logger.warning(f"Backup failed: {e}")
     
-    def _move_to_failed(self, file_path: Path, reason: str):
+    def _move_to_failed(self, file_path: Path, reason: str, fingerprint: dict = None,
+                        filename: str = None):
         try:
-            failed_dir = Path(self.config.paths.get('processing', '/processing')) / 'failed'
-            ensure_directory(failed_dir)
-            dest_path = failed_dir / file_path.name
-            
-            if dest_path.exists():
-                base, suffix, counter = dest_path.stem, dest_path.suffix, 1
-                while dest_path.exists():
-                    dest_path = failed_dir / f"{base}_{counter}{suffix}"
-                    counter += 1
-            
-            if file_path.exists():
-                shutil.move(str(file_path), str(dest_path))
+            ensure_directory(self._failed_dir)
+            try:
+                dest_path = self._move_into(file_path, self._failed_dir)
                 self.logger.info(f"→ Failed: {dest_path.name}")
+            except FileNotFoundError:
+                # Already gone; record it under the name it would have had
+                dest_path = unique_path(self._failed_dir, file_path.name)
             
-            file_hash = self.db.calculate_file_hash(dest_path)
-            self.db.add_processed_file(
-                filename=file_path.name, series=None, volume=None, chapter=None,
+            # The file was already hashed on arrival; only hash it if not
+            if fingerprint is None:
+                fingerprint = {'file_hash': self.db.calculate_file_hash(dest_path)}
+            self._record(
+                filename=filename or file_path.name, series=NO_SERIES, volume=None, chapter=None,
                 file_path=str(dest_path), cover_path=None,
-                file_hash=file_hash, status='failed', error_message=reason
+                status='failed', error_message=reason, **fingerprint
             )
         except Exception as e:
             self.logger.error(f"Move to failed failed: {e}")
     
-    def _mark_for_review(self, file_path: Path, rename_result: dict, file_hash: str, extra_message: str = None):
+    def _mark_for_review(self, file_path: Path, rename_result: dict, fingerprint: dict, extra_message: str = None):
         try:
             analysis = rename_result['analysis']
             issues = rename_result['issues'].copy()
             if extra_message:
                 issues.append(extra_message)
             
-            self.db.add_processed_file(
+            self._record(
                 filename=file_path.name,
-                series=analysis.get('series'), volume=analysis.get('volume'),
+                series=analysis.get('series') or NO_SERIES, volume=analysis.get('volume'),
                 chapter=analysis.get('chapter'), file_path=str(file_path),
-                cover_path=None, file_hash=file_hash,
-                status='needs_review', error_message='; '.join(issues)
+                cover_path=None, status='needs_review',
+                error_message='; '.join(issues), **fingerprint
             )
             
             self.logger.warning(f"Marked for review: {file_path.name}")
         except Exception as e:
             self.logger.error(f"Mark for review failed: {e}")
     
+    def _record(self, **record):
+        """Queue a processed_files row for the next flush."""
+        with self._db_lock:
+            self._pending_records.append(record)
+        self._wakeup.set()
+    
+    def flush(self):
+        """Write queued processed_files rows to the database."""
+        with self._db_lock:
+            self._flush_records()
+    
+    def _flush_records(self):
+        """Write queued rows in one transaction; caller holds _db_lock."""
+        records, self._pending_records = self._pending_records, []
+        if not records:
+            return
+        try:
+            self.db.add_processed_files(records)
+        except Exception as e:
+            # One bad row rolls back the batch; keep the others
+            self.logger.warning(f"Batch insert of {len(records)} record(s) failed: {e}")
+            for record in records:
+                try:
+                    self.db.add_processed_file(**record)
+                except Exception as e:
+                    self.logger.error(f"Recording {record['filename']} failed: {e}")
+    
+    def _volume_lock(self, series: str, volume):
+        """Get the lock for one volume of a series."""
+        with self._queue_lock:
+            return self._volume_locks[(series.lower(), volume)]
+    
+    def _file_key(self, file_path: Path):
+        """Queue key for a file, so one volume of a series is processed in order."""
+        try:
+            parsed = self.file_renamer.parser.parse(file_path.name)
+        except ValueError:
+            parsed = {'series': None}
+        if not parsed['series']:
+            return file_path
+        return (parsed['series'].lower(), parsed['volume'])
+    
     def run(self):
         """Main application loop."""
         check_interval = self.config.check_interval
         self.logger.info(f"Starting (check interval: {check_interval}s)")
         
         self.file_watcher.start()
+        # Load the library listing before the workers share it
+        self.file_renamer.series_detector.get_existing_series()
+        # Only queues the files; the worker pool processes them
         self.file_watcher.scan_existing_files()
         
         web_thread = threading.Thread(
@@ -249,19 +434,32 @@ class MangaManager:
         web_thread.start()
         self.logger.info("Web UI: http://0.0.0.0:8080")
         
-        while self.running:
+        # New files are handled by the watcher's scheduler thread as its
+        # events arrive; this loop only writes queued records, so it sleeps
+        # until one is queued. Without the scheduler it polls as before.
+        while not self._stop.is_set():
             try:
-                self.file_watcher.check_pending()
-                time.sleep(check_interval)
+                if not self.file_watcher.event_handler.scheduler_running():
+                    self._stop.wait(check_interval)
+                    self.file_watcher.check_pending()
+                else:
+                    self._wakeup.wait()
+                    self._wakeup.clear()
+                    # Let the rest of a burst queue up behind this record
+                    self._stop.wait(check_interval)
+                self.flush()
             except Exception as e:
                 self.logger.error(f"Main loop error: {e}", exc_info=True)
-                time.sleep(check_interval)
+                self._stop.wait(check_interval)
         
         self._shutdown()
     
     def _shutdown(self):
         self.logger.info("Shutting down...")
         self.file_watcher.stop()
+        self.web_ui.stop()
+        self._executor.shutdown(wait=True)
+        self.flush()
         self.db.close()
         self.logger.info("Stopped")
 
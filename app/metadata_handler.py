@@ -1,4 +1,6 @@
-from lxml import etree
+import io
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
 from pathlib import Path
 from typing import Optional, Dict, Any
 import logging
@@ -11,15 +13,114 @@ class ComicInfo:
     # ComicInfo.xml schema namespace (optional, but good practice)
     NAMESPACE = None  # ComicInfo typically doesn't use namespaces
     
+    # Field names used by the properties below
+    _F_SERIES = 'Series'
+    _F_VOLUME = 'Volume'
+    _F_NUMBER = 'Number'
+    _F_TITLE = 'Title'
+    _F_SUMMARY = 'Summary'
+    
     def __init__(self, xml_content: Optional[bytes] = None):
         """
         Args:
             xml_content: Existing ComicInfo.xml content, or None to create new
         """
+        self.tag = 'ComicInfo'
+        self._attrib = {}
+        # Top-level children in document order, as [local name, tag, text,
+        # fragment] lists. Elements with attributes or children (such as
+        # <Pages>) and comments keep their serialized fragment, which is
+        # written back as-is; comments have no name or tag.
+        self._elements = []
+        
         if xml_content:
-            self.root = etree.fromstring(xml_content)
-        else:
-            self.root = etree.Element('ComicInfo')
+            if isinstance(xml_content, str):
+                xml_content = xml_content.encode('utf-8')
+            if not self._parse(xml_content):
+                self._parse_namespaced(xml_content)
+    
+    def _parse(self, xml_content: bytes) -> bool:
+        """Read top-level fields with a streaming parse.
+        
+        Args:
+            xml_content: ComicInfo.xml content
+        
+        Returns:
+            False if the document uses namespaced elements
+        """
+        prefixes = {}
+        depth = 0
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True, insert_pis=True))
+        events = ET.iterparse(io.BytesIO(xml_content), parser=parser,
+                              events=('start-ns', 'start', 'end', 'comment', 'pi'))
+        for event, item in events:
+            if event == 'start-ns':
+                prefix, uri = item
+                prefixes[uri] = prefix
+                continue
+            if event in ('comment', 'pi'):
+                if depth == 1:
+                    item.tail = None
+                    self._elements.append([None, None, None, ET.tostring(item, encoding='unicode')])
+                continue
+            if item.tag[0] == '{':
+                return False
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    self.tag = item.tag
+                    self._attrib = {f'xmlns:{p}' if p else 'xmlns': uri
+                                    for uri, p in prefixes.items()}
+                    for name, value in item.attrib.items():
+                        if name[0] == '{':
+                            uri, local = name[1:].split('}', 1)
+                            name = f'{prefixes[uri]}:{local}' if prefixes.get(uri) else local
+                        self._attrib[name] = value
+                continue
+            depth -= 1
+            if depth == 1:
+                raw = None
+                if len(item) or item.attrib:
+                    item.tail = None
+                    raw = ET.tostring(item, encoding='unicode')
+                self._elements.append([item.tag, item.tag, item.text, raw])
+                item.clear()
+        return True
+    
+    def _parse_namespaced(self, xml_content: bytes):
+        """Read top-level fields from a namespaced document with lxml.
+        
+        Fields are looked up by local name, so <Series> under a default
+        namespace (or as ns:Series) is the Series field.
+        """
+        from lxml import etree
+        
+        self._elements = []
+        root = etree.fromstring(xml_content)
+        prefixes = {uri: prefix for prefix, uri in root.nsmap.items()}
+        
+        def qualified(name):
+            qname = etree.QName(name)
+            prefix = prefixes.get(qname.namespace)
+            return f'{prefix}:{qname.localname}' if prefix else qname.localname
+        
+        self.tag = qualified(root.tag)
+        self._attrib = {f'xmlns:{p}' if p else 'xmlns': uri for p, uri in root.nsmap.items()}
+        for name, value in root.attrib.items():
+            self._attrib[qualified(name)] = value
+        for element in root:
+            element.tail = None
+            if not isinstance(element.tag, str):
+                # Comment or processing instruction
+                self._elements.append([None, None, None, etree.tostring(element, encoding='unicode')])
+                continue
+            qname = etree.QName(element)
+            raw = None
+            if (len(element) or element.attrib
+                    or (qname.namespace is not None and qname.namespace not in prefixes)):
+                # Keep the fragment, with any namespace declared on it
+                raw = etree.tostring(element, encoding='unicode')
+            self._elements.append([qname.localname, qualified(element.tag), element.text, raw])
     
     @classmethod
     def from_file(cls, file_path: Path) -> 'ComicInfo':
@@ -34,6 +135,13 @@ class ComicInfo:
         with open(file_path, 'rb') as f:
             return cls(f.read())
     
+    def _find(self, field_name: str) -> Optional[list]:
+        """Get the first top-level element with this local name, or None."""
+        for element in self._elements:
+            if element[0] == field_name:
+                return element
+        return None
+    
     def get_field(self, field_name: str, default: Any = None) -> Any:
         """Get value of a metadata field.
         
@@ -44,8 +152,8 @@ class ComicInfo:
         Returns:
             Field value or default
         """
-        element = self.root.find(field_name)
-        return element.text if element is not None else default
+        element = self._find(field_name)
+        return element[2] if element is not None else default
     
     def set_field(self, field_name: str, value: Any):
         """Set value of a metadata field.
@@ -54,13 +162,13 @@ class ComicInfo:
             field_name: Field name (e.g., 'Series', 'Number', 'Volume')
             value: Value to set (converted to string)
         """
-        element = self.root.find(field_name)
-        
+        text = str(value) if value is not None else ''
+        element = self._find(field_name)
         if element is None:
-            # Create new element
-            element = etree.SubElement(self.root, field_name)
-        
-        element.text = str(value) if value is not None else ''
+            self._elements.append([field_name, field_name, text, None])
+        else:
+            element[2] = text
+            element[3] = None
     
     def remove_field(self, field_name: str):
         """Remove a metadata field.
@@ -68,61 +176,61 @@ class ComicInfo:
         Args:
             field_name: Field name to remove
         """
-        element = self.root.find(field_name)
+        element = self._find(field_name)
         if element is not None:
-            self.root.remove(element)
+            self._elements.remove(element)
     
     @property
     def series(self) -> Optional[str]:
         """Get series name."""
-        return self.get_field('Series')
+        return self.get_field(self._F_SERIES)
     
     @series.setter
     def series(self, value: str):
         """Set series name."""
-        self.set_field('Series', value)
+        self.set_field(self._F_SERIES, value)
     
     @property
     def volume(self) -> Optional[int]:
         """Get volume number."""
-        vol = self.get_field('Volume')
+        vol = self.get_field(self._F_VOLUME)
         return int(vol) if vol else None
     
     @volume.setter
     def volume(self, value: int):
         """Set volume number."""
-        self.set_field('Volume', value)
+        self.set_field(self._F_VOLUME, value)
     
     @property
     def number(self) -> Optional[float]:
         """Get chapter/issue number."""
-        num = self.get_field('Number')
+        num = self.get_field(self._F_NUMBER)
         return float(num) if num else None
     
     @number.setter
     def number(self, value: float):
         """Set chapter/issue number."""
-        self.set_field('Number', value)
+        self.set_field(self._F_NUMBER, value)
     
     @property
     def title(self) -> Optional[str]:
         """Get chapter title."""
-        return self.get_field('Title')
+        return self.get_field(self._F_TITLE)
     
     @title.setter
     def title(self, value: str):
         """Set chapter title."""
-        self.set_field('Title', value)
+        self.set_field(self._F_TITLE, value)
     
     @property
     def summary(self) -> Optional[str]:
         """Get summary/description."""
-        return self.get_field('Summary')
+        return self.get_field(self._F_SUMMARY)
     
     @summary.setter
     def summary(self, value: str):
         """Set summary/description."""
-        self.set_field('Summary', value)
+        self.set_field(self._F_SUMMARY, value)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert metadata to dictionary.
@@ -130,7 +238,7 @@ class ComicInfo:
         Returns:
             Dictionary of all metadata fields
         """
-        return {elem.tag: elem.text for elem in self.root}
+        return {element[0]: element[2] for element in self._elements if element[0]}
     
     def to_xml(self, pretty_print: bool = True) -> bytes:
         """Convert to XML bytes.
@@ -141,12 +249,27 @@ class ComicInfo:
         Returns:
             XML content as bytes
         """
-        return etree.tostring(
-            self.root,
-            xml_declaration=True,
-            encoding='utf-8',
-            pretty_print=pretty_print
-        )
+        attrib = ''.join(f' {name}={quoteattr(value)}' for name, value in self._attrib.items())
+        parts = []
+        for _, tag, text, raw in self._elements:
+            if raw is not None:
+                parts.append(raw)
+            elif text is None:
+                parts.append(f'<{tag}/>')
+            else:
+                parts.append(f'<{tag}>{escape(text)}</{tag}>')
+        
+        if not parts:
+            body = f'<{self.tag}{attrib}/>'
+        elif pretty_print:
+            body = f'<{self.tag}{attrib}>\n  ' + '\n  '.join(parts) + f'\n</{self.tag}>'
+        else:
+            body = f'<{self.tag}{attrib}>' + ''.join(parts) + f'</{self.tag}>'
+        
+        xml = "<?xml version='1.0' encoding='utf-8'?>\n" + body
+        if pretty_print:
+            xml += '\n'
+        return xml.encode('utf-8')
     
     def validate_required_fields(self, required: list) -> bool:
         """Check if required fields are present and non-empty.
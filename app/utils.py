@@ -1,7 +1,62 @@
+import errno
 import logging
+import os
+import shutil
 import sys
+import threading
 from pathlib import Path
 
+# Log file write buffer, and how long buffered INFO/DEBUG lines may wait
+LOG_BUFFER_SIZE = 1 << 16
+LOG_FLUSH_INTERVAL = 0.5
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler that buffers records instead of flushing each one.
+    
+    Records at flush_level or above are flushed immediately; anything else
+    is written out at most flush_interval seconds later.
+    """
+    
+    def __init__(self, filename, encoding=None, flush_level=logging.WARNING,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self._timer = None
+        super().__init__(filename, encoding=encoding)
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_BUFFER_SIZE,
+                    encoding=self.encoding, errors=self.errors)
+    
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= self.flush_level:
+                self.flush()
+            elif self._timer is None:
+                # First unflushed line: write it out after the interval
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+    
+    def flush(self):
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            super().flush()
+        finally:
+            self.release()
+
+
 def setup_logging(log_level='INFO', log_file='/logs/processor.log'):
     """Configure logging for the application.
     
@@ -28,14 +83,19 @@ def setup_logging(log_level='INFO', log_file='/logs/processor.log'):
         handlers=[
             # Console handler (stdout)
             logging.StreamHandler(sys.stdout),
-            # File handler
-            logging.FileHandler(log_file, encoding='utf-8')
+            # File handler, buffered; warnings and errors go out at once
+            BufferedFileHandler(log_file, encoding='utf-8')
         ]
     )
     
     return logging.getLogger('manga-manager')
 
 
+# Directories already created or found by ensure_directory; the app never
+# removes them while running, so they are only checked once
+_KNOWN_DIRS = set()
+
+
 def ensure_directory(path):
     """Ensure directory exists, create if not.
     
@@ -45,6 +105,82 @@ def ensure_directory(path):
     Returns:
         Path object
     """
-    path = Path(path)
+    key = os.fspath(path)
+    if key in _KNOWN_DIRS:
+        return Path(path)
+    path = Path(key)
     path.mkdir(parents=True, exist_ok=True)
+    _KNOWN_DIRS.add(key)
     return path
+
+
+def move_file(src, dst):
+    """Move a file, as a single rename when both paths share a filesystem.
+    
+    Args:
+        src: File to move
+        dst: Destination file path (replaced if it exists)
+    
+    Returns:
+        Destination as a Path object
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Different filesystems: copy and delete
+        shutil.move(str(src), str(dst))
+    return Path(dst)
+
+
+def unique_path(directory, filename):
+    """Get a path in directory for filename that does not exist yet.
+    
+    Taken names get a counter suffix (name_1.cbz, name_2.cbz, ...).
+    
+    Args:
+        directory: Target directory
+        filename: Preferred file name
+    
+    Returns:
+        Path object
+    """
+    directory = Path(directory)
+    dest_path = directory / filename
+    if not os.path.lexists(dest_path):
+        return dest_path
+    
+    # One directory listing instead of a stat per candidate name
+    with os.scandir(directory) as entries:
+        taken = {entry.name for entry in entries}
+    
+    base, suffix, counter = dest_path.stem, dest_path.suffix, 1
+    while f"{base}_{counter}{suffix}" in taken:
+        counter += 1
+    return directory / f"{base}_{counter}{suffix}"
+
+
+def reserve_path(directory, filename):
+    """Claim a new, empty file in directory for filename.
+    
+    The file is created with O_CREAT | O_EXCL, so no other writer can be
+    handed the same name; the caller moves its file over it (move_file
+    replaces it) or removes it if that fails. Taken names get a counter
+    suffix as in unique_path.
+    
+    Args:
+        directory: Target directory
+        filename: Preferred file name
+    
+    Returns:
+        Path object of the placeholder file
+    """
+    dest_path = unique_path(directory, filename)
+    while True:
+        try:
+            os.close(os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            return dest_path
+        except FileExistsError:
+            # Taken since the listing; look again
+            dest_path = unique_path(directory, filename)
@@ -1,15 +1,107 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, jsonify, request, send_file, render_template
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.serving import make_server
 from pathlib import Path
+from urllib.parse import quote
 import logging
 import base64
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
 
 from database import Database
-from cover_manager import CoverManager
+from cover_manager import CoverManager, sniff_image_format
 from file_renamer import FileRenamer
 from config import Config
 
 logger = logging.getLogger('manga-manager.web')
 
+# How long a /api/stats response is reused while the database is unchanged
+STATS_CACHE_SECONDS = 2.0
+
+# Uploads from this size are converted in the background (202 + job id);
+# smaller ones are answered directly
+UPLOAD_ASYNC_BYTES = 2 * 1024 * 1024
+
+# Largest request body accepted (cover uploads are the big ones)
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# Review queue page size: default, and the most a client may ask for
+REVIEW_PAGE_SIZE = 50
+MAX_REVIEW_PAGE_SIZE = 500
+
+# JSON responses from this size are gzipped for clients that accept it;
+# level 4 gives most of the size reduction at a fraction of level 9's CPU
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 4
+
+# Number of (series, volume) cover lookups remembered by the cover endpoint
+COVER_PATH_CACHE_SIZE = 4096
+
+# Background upload jobs remembered for /api/jobs/<id>, oldest dropped first
+MAX_UPLOAD_JOBS = 256
+
+
+class _JSONProvider(DefaultJSONProvider):
+    """jsonify settings for the API.
+    
+    Keys keep row order instead of being sorted, output has no indentation
+    and non-ASCII titles are written as UTF-8 rather than \\u escapes.
+    sqlite3.Row objects are converted while encoding, so endpoints can
+    return fetched rows without copying them into dicts first.
+    """
+    
+    sort_keys = False
+    compact = True
+    ensure_ascii = False
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, sqlite3.Row):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+
+def _parse_update(data):
+    """Validate a file update body.
+    
+    Args:
+        data: Decoded JSON body
+    
+    Returns:
+        Tuple of (series, volume, chapter); volume may be None
+    
+    Raises:
+        ValueError: If a field is missing or has the wrong type
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Invalid JSON body')
+    
+    series = data.get('series')
+    volume = data.get('volume')
+    chapter = data.get('chapter')
+    
+    if not series or chapter is None:
+        raise ValueError('Missing required fields')
+    if not isinstance(series, str):
+        raise ValueError('series must be a string')
+    # bool is an int subclass, but true/false is never a volume or chapter
+    if volume is not None and type(volume) is not int:
+        raise ValueError('volume must be an integer or null')
+    if type(chapter) not in (int, float):
+        raise ValueError('chapter must be a number')
+    
+    return series, volume, chapter
+
+
 class WebUI:
     """Web interface for manual review and monitoring."""
     
@@ -31,6 +123,29 @@ class WebUI:
         self.app = Flask(__name__, 
                          template_folder='web/templates',
                          static_folder='web/static')
+        self.app.json = _JSONProvider(self.app)
+        # The page templates take no context, so each is rendered once and
+        # the HTML reused; templates are not re-checked on disk either
+        self.app.jinja_env.auto_reload = False
+        self._pages = {}
+        self._server = None
+        self.app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+        # Internal location a reverse proxy maps to the covers directory;
+        # when set, cover bodies are sent by the proxy (X-Accel-Redirect)
+        self.x_accel_covers = config.get('web', 'x_accel_covers', default='') if config else ''
+        
+        # Background cover uploads: job id -> future, oldest first
+        self._upload_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cover-upload')
+        self._jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        
+        # (series, volume) -> (cover path or None, database version), least
+        # recently used first; a miss is only trusted while the version holds
+        self._cover_paths = OrderedDict()
+        self._cover_paths_lock = threading.Lock()
+        
+        # (expires_at, database version, JSON body) of the last stats response
+        self._stats_cache = (0.0, None, None)
         
         self._setup_routes()
         logger.info("Web UI initialized")
@@ -48,51 +163,107 @@ class WebUI:
         self.app.route('/api/files/<int:file_id>/update', methods=['POST'])(self._api_update_file)
         self.app.route('/api/covers/upload', methods=['POST'])(self._api_upload_cover)
         self.app.route('/api/covers/<series>/<int:volume>', methods=['GET'])(self._api_get_cover)
+        self.app.route('/api/jobs/<job_id>', methods=['GET'])(self._api_get_job)
         self.app.route('/api/stats', methods=['GET'])(self._api_stats)
+        
+        self.app.after_request(self._compress_response)
+        self.app.teardown_request(self._release_db)
     
     # UI Pages
     
     def _index(self):
         """Main dashboard page."""
-        return render_template('index.html')
+        return self._render_page('index.html')
     
     def _review_page(self):
         """Manual review page."""
-        return render_template('review.html')
+        return self._render_page('review.html')
+    
+    def _render_page(self, template):
+        """Render a context-free page template, once outside debug mode."""
+        if self.app.debug:
+            return render_template(template)
+        page = self._pages.get(template)
+        if page is None:
+            page = self._pages[template] = render_template(template)
+        return page
+    
+    def _release_db(self, exc=None):
+        """Close the request thread's database connections.
+        
+        The threaded server runs each request on a new thread, so a
+        connection kept for the thread would never be used again.
+        """
+        self.db.release_thread()
+    
+    def _compress_response(self, response):
+        """Gzip a JSON response body when the client accepts it.
+        
+        Covers (JPEG) and pages are left alone, as are small bodies,
+        where the gzip header would eat most of the saving.
+        """
+        if (response.mimetype != 'application/json'
+                or response.direct_passthrough
+                or response.status_code != 200
+                or 'Content-Encoding' in response.headers):
+            return response
+        
+        response.vary.add('Accept-Encoding')
+        if not request.accept_encodings['gzip']:
+            return response
+        
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(gzip.compress(data, COMPRESS_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
     
     # API Endpoints
     
     def _api_files_needing_review(self):
-        """Get list of files needing manual review."""
+        """Get a page of files needing manual review.
+        
+        Query args ``limit`` and ``after_id`` select the page; the response's
+        ``next_cursor`` is the ``after_id`` for the next one (None at the end).
+        """
         try:
-            files = self.db.get_files_needing_review()
+            limit = request.args.get('limit', REVIEW_PAGE_SIZE, type=int)
+            limit = max(1, min(limit, MAX_REVIEW_PAGE_SIZE))
+            after_id = request.args.get('after_id', type=int)
+            
+            # Rows carry exactly the fields the review page shows
+            files = self.db.get_review_page(limit, after_id)
             
+            # Cover status for every row from one stat per distinct volume's
+            # cover file, rather than a request per file
+            pairs = [(f['series'], f['volume']) for f in files if f['series'] and f['volume']]
+            covers = self.cover_mgr.has_covers_bulk(pairs)
+            
+            # Column names are read once per page and zipped with each
+            # row's values, instead of dict(row) looking up every key
+            keys = files[0].keys() if files else ()
+            cover_of = covers.get
             result = []
-            for file in files:
-                result.append({
-                    'id': file['id'],
-                    'filename': file['filename'],
-                    'series': file['series'],
-                    'volume': file['volume'],
-                    'chapter': file['chapter'],
-                    'file_path': file['file_path'],
-                    'processed_date': file['processed_date'],
-                    'error_message': file['error_message']
-                })
+            add = result.append
+            for f in files:
+                item = dict(zip(keys, f))
+                item['has_cover'] = cover_of((item['series'], item['volume']), False)
+                add(item)
             
-            return jsonify({'success': True, 'files': result})
+            next_cursor = files[-1]['id'] if len(files) == limit else None
+            
+            return jsonify({'success': True, 'files': result, 'next_cursor': next_cursor})
             
         except Exception as e:
-            logger.error(f"Error getting files needing review: {e}")
+            logger.error("Error getting files needing review: %s", e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
     def _api_get_file(self, file_id):
         """Get details about a specific file."""
         try:
             # Get file from database
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT * FROM processed_files WHERE id = ?', (file_id,))
-            file = cursor.fetchone()
+            file = self.db.get_file(file_id)
             
             if not file:
                 return jsonify({'success': False, 'error': 'File not found'}), 404
@@ -119,36 +290,34 @@ class WebUI:
             })
             
         except Exception as e:
-            logger.error(f"Error getting file {file_id}: {e}")
+            logger.error("Error getting file %s: %s", file_id, e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
     def _api_update_file(self, file_id):
         """Update file metadata (series, volume, chapter)."""
         try:
-            data = request.get_json()
-            
-            series = data.get('series')
-            volume = data.get('volume')
-            chapter = data.get('chapter')
-            
-            if not all([series, chapter is not None]):
-                return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+            # Parsed straight from the body: not cached on the request, and
+            # no Content-Type check
+            try:
+                data = self.app.json.loads(request.get_data(cache=False))
+            except ValueError:
+                data = None
+            try:
+                series, volume, chapter = _parse_update(data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
             # Update database
-            cursor = self.db.conn.cursor()
-            cursor.execute('''
-                UPDATE processed_files 
-                SET series = ?, volume = ?, chapter = ?, status = 'completed'
-                WHERE id = ?
-            ''', (series, volume, chapter, file_id))
-            self.db.conn.commit()
+            self.db.update_file_metadata(file_id, series, volume, chapter)
             
-            logger.info(f"Updated file {file_id}: {series} Vol.{volume} Ch.{chapter}")
+            logger.info("Updated file %s: %s Vol.%s Ch.%s", file_id, series, volume, chapter)
             
             return jsonify({'success': True, 'message': 'File updated successfully'})
             
+        except RequestEntityTooLarge:
+            return jsonify({'success': False, 'error': 'Request too large'}), 413
         except Exception as e:
-            logger.error(f"Error updating file {file_id}: {e}")
+            logger.error("Error updating file %s: %s", file_id, e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
     def _api_upload_cover(self):
@@ -170,58 +339,194 @@ class WebUI:
             if cover_file.filename == '':
                 return jsonify({'success': False, 'error': 'Empty filename'}), 400
             
-            # Read cover data
-            cover_data = cover_file.read()
+            # Turn away anything that is not a JPEG/PNG/GIF/WebP before it
+            # reaches the image decoder
+            head = cover_file.stream.read(12)
+            cover_file.stream.seek(0)
+            if sniff_image_format(head) is None:
+                return jsonify({'success': False, 'error': 'Unsupported image format'}), 400
             
-            # Save cover
-            success, cover_path, message = self.cover_mgr.save_uploaded_cover(
-                series, volume, cover_data
-            )
+            cover_file.stream.seek(0, os.SEEK_END)
+            size = cover_file.stream.tell()
+            cover_file.stream.seek(0)
+            if size >= UPLOAD_ASYNC_BYTES:
+                job_id = self._submit_upload(series, volume, cover_file.stream)
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'}), 202
             
-            if success:
-                logger.info(f"Cover uploaded for {series} Vol.{volume}")
-                return jsonify({
-                    'success': True,
-                    'message': message,
-                    'cover_path': str(cover_path)
-                })
-            else:
-                return jsonify({'success': False, 'error': message}), 500
+            # Save cover, decoding straight from the upload's stream
+            return self._upload_response(*self._save_cover(
+                series, volume, cover_file.stream
+            ), series=series, volume=volume)
                 
+        except RequestEntityTooLarge:
+            return jsonify({'success': False, 'error': 'Upload too large'}), 413
+        except Exception as e:
+            logger.error("Error uploading cover: %s", e)
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def _upload_response(self, success, cover_path, message, series, volume):
+        """Build the response for a finished cover upload."""
+        if success:
+            logger.info("Cover uploaded for %s Vol.%s", series, volume)
+            return jsonify({
+                'success': True,
+                'message': message,
+                'cover_path': str(cover_path)
+            })
+        return jsonify({'success': False, 'error': message}), 500
+    
+    def _save_cover(self, series, volume, cover_data):
+        """Save an uploaded cover and drop its remembered lookup."""
+        result = self.cover_mgr.save_uploaded_cover(series, volume, cover_data)
+        if result[0]:
+            self._forget_cover_path(series, volume)
+        return result
+    
+    def _submit_upload(self, series, volume, stream):
+        """Queue a large upload for conversion and return its job id.
+        
+        The request's stream goes away with the request, so it is spooled to
+        a temporary file first.
+        """
+        with tempfile.NamedTemporaryFile(dir=self.cover_mgr.covers_path, suffix='.upload',
+                                         delete=False) as tmp:
+            try:
+                shutil.copyfileobj(stream, tmp, 1 << 20)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        
+        def convert():
+            try:
+                with open(tmp.name, 'rb') as f:
+                    return self._save_cover(series, volume, f)
+            finally:
+                os.unlink(tmp.name)
+        
+        job_id = uuid.uuid4().hex
+        try:
+            future = self._upload_executor.submit(convert)
+        except BaseException:
+            # Never queued (e.g. the executor is shut down), so convert()
+            # will not remove the spooled file
+            os.unlink(tmp.name)
+            raise
+        with self._jobs_lock:
+            self._jobs[job_id] = (future, series, volume)
+            while len(self._jobs) > MAX_UPLOAD_JOBS:
+                self._jobs.popitem(last=False)
+        return job_id
+    
+    def _api_get_job(self, job_id):
+        """Get the state of a background cover upload."""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        
+        future, series, volume = job
+        if not future.done():
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'}), 202
+        try:
+            return self._upload_response(*future.result(), series=series, volume=volume)
         except Exception as e:
-            logger.error(f"Error uploading cover: {e}")
+            logger.error("Error uploading cover: %s", e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
     def _api_get_cover(self, series, volume):
         """Get cover image for a series/volume."""
         try:
-            cover_path = self.cover_mgr.get_existing_cover(series, volume)
+            cover_path = self._lookup_cover(series, volume)
             
-            if cover_path and cover_path.exists():
-                return send_file(cover_path, mimetype='image/jpeg')
-            else:
+            try:
+                stat = cover_path.stat() if cover_path else None
+            except FileNotFoundError:
+                self._forget_cover_path(series, volume)
+                stat = None
+            if stat is None:
                 return jsonify({'success': False, 'error': 'Cover not found'}), 404
+            
+            # Browsers revalidate the cached thumbnail each time (an upload
+            # replaces the file in place); an unchanged cover costs a 304
+            # without opening the file
+            etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+            if request.if_none_match.contains_weak(etag):
+                not_modified = self.app.response_class(status=304)
+                not_modified.set_etag(etag)
+                return not_modified
+            
+            if self.x_accel_covers:
+                try:
+                    relative = cover_path.relative_to(self.cover_mgr.covers_path)
+                except ValueError:
+                    relative = None
+                if relative is not None:
+                    # nginx streams the file itself with sendfile()
+                    location = self.x_accel_covers.rstrip('/') + '/' + quote(relative.as_posix())
+                    return self.app.response_class(headers={
+                        'X-Accel-Redirect': location,
+                        'Content-Type': 'image/jpeg',
+                    })
+            
+            return send_file(cover_path, mimetype='image/jpeg', etag=etag,
+                             last_modified=stat.st_mtime, max_age=0)
                 
         except Exception as e:
-            logger.error(f"Error getting cover for {series} Vol.{volume}: {e}")
+            logger.error("Error getting cover for %s Vol.%s: %s", series, volume, e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
+    def _lookup_cover(self, series, volume):
+        """Get a volume's cover path, remembering the answer.
+        
+        Covers in the cover cache are kept until the file disappears or a new
+        cover is uploaded. Misses are kept only while the database is
+        unchanged, since processing a file may extract its volume's cover.
+        Covers found through the database are not kept: a cover extracted
+        or uploaded later takes their place.
+        """
+        key = (series, volume)
+        version = self.db.version
+        cache, lock = self._cover_paths, self._cover_paths_lock
+        with lock:
+            entry = cache.get(key)
+            if entry is not None and (entry[0] is not None or entry[1] == version):
+                cache.move_to_end(key)
+                return entry[0]
+        
+        cover_path = self.cover_mgr.get_existing_cover(series, volume)
+        if cover_path is not None and cover_path != self.cover_mgr.get_cover_path(series, volume):
+            return cover_path
+        with lock:
+            cache[key] = (cover_path, version)
+            cache.move_to_end(key)
+            if len(cache) > COVER_PATH_CACHE_SIZE:
+                cache.popitem(last=False)
+        return cover_path
+    
+    def _forget_cover_path(self, series, volume):
+        """Drop a remembered cover lookup."""
+        with self._cover_paths_lock:
+            self._cover_paths.pop((series, volume), None)
+    
     def _api_stats(self):
         """Get processing statistics."""
+        expires_at, version, body = self._stats_cache
+        if body is not None and version == self.db.version and time.monotonic() < expires_at:
+            return self.app.response_class(body, mimetype='application/json')
+        
         try:
-            cursor = self.db.conn.cursor()
+            version = self.db.version
+            cursor = self.db.get_read_conn().cursor()
             
-            # Count by status
+            # Count by status; the total is their sum
             cursor.execute('''
                 SELECT status, COUNT(*) as count 
                 FROM processed_files 
                 GROUP BY status
             ''')
             status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
-            
-            # Total files
-            cursor.execute('SELECT COUNT(*) as total FROM processed_files')
-            total = cursor.fetchone()['total']
+            total = sum(status_counts.values())
             
             # Recent files
             cursor.execute('''
@@ -229,9 +534,9 @@ class WebUI:
                 ORDER BY processed_date DESC 
                 LIMIT 10
             ''')
-            recent = [dict(row) for row in cursor.fetchall()]
+            recent = cursor.fetchall()
             
-            return jsonify({
+            response = jsonify({
                 'success': True,
                 'stats': {
                     'total': total,
@@ -239,9 +544,11 @@ class WebUI:
                     'recent': recent
                 }
             })
+            self._stats_cache = (time.monotonic() + STATS_CACHE_SECONDS, version, response.get_data())
+            return response
             
         except Exception as e:
-            logger.error(f"Error getting stats: {e}")
+            logger.error("Error getting stats: %s", e)
             return jsonify({'success': False, 'error': str(e)}), 500
     
     def run(self, host='0.0.0.0', port=8080, debug=False):
@@ -252,5 +559,19 @@ class WebUI:
             port: Port to listen on
             debug: Enable debug mode
         """
-        logger.info(f"Starting web UI on {host}:{port}")
-        self.app.run(host=host, port=port, debug=debug)
+        logger.info("Starting web UI on %s:%s", host, port)
+        if debug:
+            self.app.run(host=host, port=port, debug=debug)
+            return
+        
+        # Each request gets its own thread, so cover and stats requests
+        # overlap; they share this process's database and cover manager
+        self._server = make_server(host, port, self.app, threaded=True)
+        self._server.serve_forever()
+    
+    def stop(self):
+        """Stop the web server started by run()."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        self._upload_executor.shutdown(wait=True)